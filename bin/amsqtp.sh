@@ -8,4 +8,5 @@ srcpath="$HOME/qtp/qtp"
 
 # Run the QTP program.
 # !!! You should not change it. !!!
-exec $py3 "$srcpath"/qtp.py "$@"
+export PYTHONPATH="$(dirname "$srcpath")${PYTHONPATH:+:$PYTHONPATH}"
+exec $py3 -m qtp "$@"
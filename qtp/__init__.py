@@ -0,0 +1,41 @@
+"""Quantum Transport Properties (QTP).
+
+Tunneling properties of a particle through a 1D potential energy barrier,
+e.g.::
+
+    import qtp
+
+    calc = qtp.Calculator.from_file('potential.dat', pmass=1)
+    rates = calc.rates([200, 300, 400])
+    print(rates['k_total'])
+
+The program itself is run with `python -m qtp`.
+The names below are imported from their modules on first access, so that
+importing the package does not load NumPy's and SciPy's submodules before
+they are needed.
+"""
+import importlib
+
+_exports = {
+    'Calculator': 'calculator',
+    'PEB': 'peb',
+    'TransCoeff': 'traco',
+    'PFlux': 'pflux',
+    'Settings': 'settings',
+    'Ensemble': 'ensemble',
+    'Cache': 'cache',
+    'load_data': 'datafile',
+    'get_output': 'output',
+    'main': 'qtp',
+}
+
+__all__ = list(_exports)
+
+def __getattr__(name):
+    if name in _exports:
+        module = importlib.import_module(f".{_exports[name]}", __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+def __dir__():
+    return sorted(list(globals()) + __all__)
@@ -0,0 +1,3 @@
+from .qtp import main
+
+main()
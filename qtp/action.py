@@ -0,0 +1,164 @@
+"""Quadrature engines for the WKB action integrals, int sqrt(U(z) - E) dz.
+
+An engine is called as `engine(peb, Evals, z0, z1)` and returns the action
+integrals of `peb` over the intervals [z0[i], z1[i]] at the energies
+Evals[i]; all three arrays have the same length.
+The ends of each interval are either turning points, U(z) = E, or the
+limits of the barrier.
+"""
+import numpy as np
+
+from scipy import integrate
+
+from . import profiling
+
+class AdaptiveAction(object):
+    """Adaptive vector quadrature of the action integrals.
+
+    All the integrals are evaluated together by `scipy.integrate.quad_vec`,
+    which shares the subdivisions among them.
+    This is the reference engine, and the fallback of `GaussAction`.
+
+    Parameters
+    ----------
+    rtol : float, optional
+        Relative tolerance, with respect to the largest integral.
+    """
+
+    def __init__(self, rtol=1.0e-10):
+        self.rtol = rtol
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(rtol={self.rtol!r})"
+
+    def get_error(self, action):
+        """Return the error bound of action integrals up to `action`."""
+        return self.rtol * action
+
+    def __call__(self, peb, Evals, z0, z1):
+        if not len(Evals):
+            return np.zeros(0)
+        dz = z1 - z0
+
+        def fun(t):
+            return dz * np.sqrt(np.maximum(peb(z0 + t*dz) - Evals, 0))
+
+        intgl = integrate.quad_vec(fun, 0, 1, epsrel=self.rtol, norm='max',
+                                   limit=500, full_output=profiling.enabled)
+        profiling.quad_vec('action.quad_vec', intgl, len(Evals))
+        return intgl[0]
+
+
+class GaussAction(object):
+    """Fixed-order Gauss-Legendre quadrature of the action integrals.
+
+    Each interval is divided at the knots of the barrier's spline, so that
+    U(z) is a cubic polynomial on each piece.
+    On each piece, z = z0 + (z1 - z0) * (1 - cos(theta)) / 2 maps
+    theta in [0, pi] onto [z0, z1]; this removes the square-root behaviour
+    of the integrand at the turning points and clusters the nodes towards
+    the knots, where the derivatives of U(z) are not continuous.
+    The integral over theta is evaluated with `order` Gauss-Legendre nodes
+    and, to estimate its error, with `order // 2` nodes; all nodes are
+    evaluated by a single call to the spline.
+    The error estimate is very conservative, as it is the error of the lower
+    order rule; the intervals for which it exceeds `tol` are integrated
+    again by `fallback`.
+
+    Parameters
+    ----------
+    order : int, optional
+        Number of Gauss-Legendre nodes per piece.
+
+    tol : float, optional
+        Largest accepted error estimate of each action integral.
+
+    fallback : engine, optional
+        Engine for the rejected intervals; an `AdaptiveAction` by default.
+    """
+
+    def __init__(self, order=16, tol=1.0e-8, fallback=None):
+        self.order = order
+        self.tol = tol
+        self.fallback = AdaptiveAction() if fallback is None else fallback
+
+        self._rules = []
+        for n in (order, order//2):
+            x, w = np.polynomial.legendre.leggauss(n)
+            theta = 0.5*np.pi * (x + 1)
+            self._rules.append((0.5*(1 - np.cos(theta)),
+                                0.25*np.pi * w * np.sin(theta)))
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(order={self.order!r}, "
+                f"tol={self.tol!r}, fallback={self.fallback!r})")
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_rules']
+        return state
+
+    def __setstate__(self, state):
+        self.__init__(state['order'], state['tol'], state['fallback'])
+
+    def get_error(self, action):
+        """Return the error bound of action integrals up to `action`.
+
+        The bound holds for each interval; it is that of the fallback
+        wherever the latter is looser than `tol`.
+        """
+        return max(self.tol, self.fallback.get_error(action))
+
+    @staticmethod
+    def _get_pieces(knots, z0, z1):
+        """Divide the intervals [z0, z1] at the spline knots.
+
+        Return
+        ------
+        rows : ndarray of int
+            Index of the interval of each piece.
+
+        p0, p1 : ndarrays
+            Limits of each piece.
+        """
+        nk = len(knots)
+        i0 = np.searchsorted(knots, z0, side='right')
+        i1 = np.searchsorted(knots, z1, side='left')
+        npieces = np.maximum(i1 - i0, 0) + 1
+
+        rows = np.repeat(np.arange(len(z0)), npieces)
+        j = np.arange(len(rows)) - np.repeat(np.cumsum(npieces) - npieces, npieces)
+        k = i0[rows] + j
+        p0 = np.where(j == 0, z0[rows], knots[np.clip(k - 1, 0, nk - 1)])
+        p1 = np.where(j == npieces[rows] - 1, z1[rows],
+                      knots[np.clip(k, 0, nk - 1)])
+        return rows, p0, p1
+
+    def __call__(self, peb, Evals, z0, z1):
+        nint = len(Evals)
+        if not nint:
+            return np.zeros(0)
+
+        rows, p0, p1 = self._get_pieces(peb.pebspl.get_knots(), z0, z1)
+        dz = (p1 - p0)[:, None]
+        E = Evals[rows][:, None]
+
+        (x_hi, w_hi), (x_lo, w_lo) = self._rules
+        x = np.concatenate([x_hi, x_lo])
+        fvals = dz * np.sqrt(np.maximum(peb(p0[:, None] + dz*x) - E, 0))
+        hi = fvals[:, :len(x_hi)] @ w_hi
+        lo = fvals[:, len(x_hi):] @ w_lo
+
+        intgl = np.bincount(rows, hi, minlength=nint)
+        error = np.bincount(rows, np.abs(hi - lo), minlength=nint)
+
+        redo = np.nonzero(error > self.tol)[0]
+        if len(redo):
+            intgl[redo] = self.fallback(peb, Evals[redo], z0[redo], z1[redo])
+
+        profiling.count('action.gauss.integrals', nint)
+        profiling.count('action.gauss.pieces', len(rows))
+        profiling.count('action.gauss.integrand_evals', fvals.size)
+        profiling.count('action.gauss.fallbacks', len(redo))
+        profiling.maximum('action.gauss.max_error', float(error.max()))
+        return intgl
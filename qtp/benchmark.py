@@ -0,0 +1,422 @@
+"""Benchmark and accuracy suite based on synthetic potential energy barriers.
+
+Usage: python -m qtp.benchmark [-o report.json] [-quick]
+
+For each synthetic barrier and point density, the stages of the program
+(PEB, topology, T(E), T(E) table, fluxes and activation energies, also in
+the energy domain, and the sensitivities of ln k to the data points) are
+timed separately, the evaluations of the U(z) spline are counted, and the
+results are compared against references calculated from the analytic U(z)
+or, for the sensitivities, against central differences.
+The numerical errors of the rate constants alone, against a tight
+calculation on the same spline, are compared with their estimates.
+The whole program is also timed on a data file of the same barrier.
+The report is written as JSON with sorted keys, so that the reports of two
+versions can be compared with `diff`.
+"""
+import os
+import sys
+
+import argparse
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+import numpy as np
+
+import scipy
+from scipy import integrate, optimize
+
+from .action import AdaptiveAction, GaussAction
+from .peb import PEB
+from .traco import TransCoeff
+from .pflux import PFlux
+from .sensitivity import get_data_sensitivities, get_sensitivities
+from .units import angst2bohr, dalton2me, kelvin2au
+
+
+class Barrier(object):
+    """Synthetic symmetric barrier U(z) on [-L, L] with U(-L) = U(L) = 0.
+
+    Subclasses define `shape(z)`, the unshifted potential, and may override
+    `get_action` with a closed-form expression.
+    Lengths are in bohr and energies in hartree.
+    """
+
+    name = None
+    L = None
+
+    def shape(self, z):
+        raise NotImplementedError
+
+    def __call__(self, z):
+        return self.shape(z) - self.shape(self.L)
+
+    @property
+    def z_Umax(self):
+        """Point of maximum with z <= 0."""
+        if not hasattr(self, '_z_Umax'):
+            res = optimize.minimize_scalar(lambda z: -self(z),
+                                           bounds=(-self.L, 0),
+                                           method='bounded',
+                                           options={'xatol': 1e-12})
+            self._z_Umax = res.x if -res.fun > self(0) + 1e-12 else 0.0
+        return self._z_Umax
+
+    @property
+    def Umax(self):
+        return float(self(self.z_Umax))
+
+    @property
+    def U0(self):
+        return float(self(0))
+
+    @property
+    def peb_type(self):
+        return 'type01' if self.z_Umax == 0 else 'type02'
+
+    def get_data(self, npts):
+        """Return `npts` points (z in bohr, U in hartree) on [0, L]."""
+        z = np.linspace(0, self.L, npts)
+        return z, self(z)
+
+    def get_action(self, E):
+        """Return int sqrt(U(z) - E) dz between the relevant turning points.
+
+        For 'type02' barriers and E >= U(0), only the hump with z < 0 is
+        considered, as in `TransCoeff`.
+        """
+        zm = self.z_Umax
+        z1 = optimize.brentq(lambda z: self(z) - E, -self.L, zm, xtol=1e-14)
+        fun = lambda z: np.sqrt(max(self(z) - E, 0))
+        if self.peb_type == 'type02' and E >= self.U0:
+            z2 = optimize.brentq(lambda z: self(z) - E, zm, 0, xtol=1e-14)
+            return integrate.quad(fun, z1, z2, points=[zm], epsabs=1e-14,
+                                  epsrel=1e-12, limit=200)[0]
+        return 2*integrate.quad(fun, z1, 0, points=[zm] if zm < 0 else None,
+                                epsabs=1e-14, epsrel=1e-12, limit=200)[0]
+
+    def get_ln_traco(self, E, pmass):
+        """Return the reference ln(T(E)) for 0 < E < Umax."""
+        ln_prefac = np.log(0.5) \
+                if self.peb_type == 'type02' and E >= self.U0 else 0
+        return ln_prefac - 2*np.sqrt(2*pmass) * self.get_action(E)
+
+    def get_rates(self, betas, pmass):
+        """Return reference ln(k) and activation energies.
+
+        With k_q = beta * I and I = int T(E) exp(-beta*E) dE over [0, Umax],
+        the tunneling activation energy is -d ln(k_q)/d(beta) = <E> - 1/beta.
+
+        Return
+        ------
+        ln_kc, ln_kq, ln_ktot, eact_c, eact_q, eact_tot : ndarrays
+        """
+        Umax = self.Umax
+        points = [self.U0] if self.peb_type == 'type02' else None
+
+        # nodes of the energy integrals, shared by all temperatures; the
+        # panels are graded geometrically towards the lower end of each
+        # range, where ln(T(E)) is not smooth (e.g., E ln(E) terms of the
+        # action of barriers with exponential tails)
+        edges = np.unique(np.r_[0, points or [], Umax])
+        grading = np.r_[0, 2.0**np.arange(-30, -6), np.linspace(2**-6, 1, 64)]
+        edges = np.unique(np.concatenate([e0 + (e1 - e0)*grading
+                                          for e0, e1 in zip(edges[:-1],
+                                                            edges[1:])]))
+        x, w = np.polynomial.legendre.leggauss(20)
+        E = (0.5*(edges[:-1] + edges[1:])[:, None]
+             + 0.5*np.diff(edges)[:, None] * x).ravel()
+        wE = (0.5*np.diff(edges)[:, None] * w).ravel()
+        traco = np.exp([self.get_ln_traco(e, pmass) for e in E])
+
+        ln_kc, ln_kq, eact_q = [], [], []
+        for beta in betas:
+            weights = wE * traco * np.exp(-beta * (E - E[0]))
+            intgl = weights.sum()
+            ln_kq.append(np.log(beta * intgl) - beta * E[0])
+            eact_q.append(np.dot(weights, E) / intgl - 1/beta)
+            ln_kc.append(-beta * Umax)
+        ln_kc, ln_kq, eact_q = map(np.array, (ln_kc, ln_kq, eact_q))
+        ln_ktot = np.logaddexp(ln_kc, ln_kq)
+        eact_c = np.full_like(eact_q, Umax)
+        eact_tot = np.exp(ln_kc - ln_ktot) * eact_c \
+                 + np.exp(ln_kq - ln_ktot) * eact_q
+        return ln_kc, ln_kq, ln_ktot, eact_c, eact_q, eact_tot
+
+
+class Eckart(Barrier):
+    """U(z) = V0 / cosh(z/a)**2, with the WKB action pi*a*(sqrt(V0) - sqrt(E))."""
+
+    name = 'eckart'
+
+    def __init__(self, V0=0.02, a=0.7, L=6.0):
+        self.V0, self.a, self.L = V0, a, L
+
+    def shape(self, z):
+        return self.V0 / np.cosh(np.asarray(z)/self.a)**2
+
+    @property
+    def z_Umax(self):
+        return 0.0
+
+    def get_action(self, E):
+        # the shift of the barrier is a shift of the energy
+        E = E + self.shape(self.L)
+        return np.pi * self.a * (np.sqrt(self.V0) - np.sqrt(E))
+
+
+class Parabolic(Barrier):
+    """U(z) = V0 * (1 - (z/L)**2), with the action pi*L*(V0 - E)/(2*sqrt(V0))."""
+
+    name = 'parabolic'
+
+    def __init__(self, V0=0.02, L=1.5):
+        self.V0, self.L = V0, L
+
+    def shape(self, z):
+        return self.V0 * (1 - (np.asarray(z)/self.L)**2)
+
+    @property
+    def z_Umax(self):
+        return 0.0
+
+    def get_action(self, E):
+        return np.pi * self.L * (self.V0 - E) / (2*np.sqrt(self.V0))
+
+
+class Gaussian(Barrier):
+    """U(z) = V0 * exp(-z**2 / (2*sigma**2))."""
+
+    name = 'gaussian'
+
+    def __init__(self, V0=0.03, sigma=0.6, L=3.6):
+        self.V0, self.sigma, self.L = V0, sigma, L
+
+    def shape(self, z):
+        return self.V0 * np.exp(-np.asarray(z)**2 / (2*self.sigma**2))
+
+    @property
+    def z_Umax(self):
+        return 0.0
+
+
+class DoubleHump(Barrier):
+    """Two Gaussian humps at z = -d and z = d with a well at z = 0 ('type02')."""
+
+    name = 'double_hump'
+
+    def __init__(self, V0=0.03, sigma=0.4, d=1.0, L=3.4):
+        self.V0, self.sigma, self.d, self.L = V0, sigma, d, L
+
+    def shape(self, z):
+        z = np.asarray(z)
+        return self.V0 * (np.exp(-(z - self.d)**2 / (2*self.sigma**2))
+                          + np.exp(-(z + self.d)**2 / (2*self.sigma**2)))
+
+
+class CountingPEB(PEB):
+    """PEB counting the calls and the points at which U(z) is evaluated."""
+
+    def __init__(self, zvals, Uvals):
+        super().__init__(zvals, Uvals)
+        self.ncalls = 0
+        self.npoints = 0
+
+    def __call__(self, z, der=0, ext=1):
+        self.ncalls += 1
+        self.npoints += np.size(z)
+        return super().__call__(z, der=der, ext=ext)
+
+
+def run_stages(barrier, npts, temps_K, pmass_Da, nenergies=64):
+    """Time and check each stage of the calculation for a barrier.
+
+    Return
+    ------
+    dict with the timings (s), the evaluation counts and the errors.
+    """
+    pmass = pmass_Da * dalton2me
+    betas = 1/(np.asarray(temps_K, dtype=float)*kelvin2au)
+    timings, counts, errors = {}, {}, {}
+
+    def count(stage, peb):
+        counts[stage] = {'calls': peb.ncalls, 'points': peb.npoints}
+        peb.ncalls = peb.npoints = 0
+
+    t0 = time.perf_counter()
+    peb = CountingPEB(*barrier.get_data(npts))
+    timings['peb'] = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    topo = peb.topology
+    peb.branches
+    timings['topology'] = time.perf_counter() - t0
+    count('topology', peb)
+    errors['Umax_abs'] = abs(topo.Umax - barrier.Umax)
+
+    # T(E) from scratch at energies avoiding the kinks at U(0) and Umax
+    Evals = barrier.Umax * (0.01 + 0.98*(np.arange(nenergies) + 0.5)/nenergies)
+    if barrier.peb_type == 'type02':
+        Evals = Evals[np.abs(Evals - barrier.U0) > 1e-3*barrier.Umax]
+    ref_ln_T = np.array([barrier.get_ln_traco(E, pmass) for E in Evals])
+
+    traco = TransCoeff(peb, pmass)
+    t0 = time.perf_counter()
+    ln_T = traco.batch_energy(Evals)[0]
+    timings['traco'] = time.perf_counter() - t0
+    count('traco', peb)
+    errors['ln_traco_abs'] = float(np.max(np.abs(ln_T - ref_ln_T)))
+
+    # T(E) table
+    traco = TransCoeff(peb, pmass)
+    pflux = PFlux(traco)
+    t0 = time.perf_counter()
+    table = traco.get_table(pflux.table_tol)
+    timings['table'] = time.perf_counter() - t0
+    count('table', peb)
+    counts['table']['nodes'] = table.nevals
+    errors['ln_traco_table_abs'] = float(np.max(np.abs(table(Evals) - ref_ln_T)))
+
+    # fluxes and activation energies
+    t0 = time.perf_counter()
+    j_c, j_q, j_tot, *eact = pflux.many(betas, moments=True)
+    timings['flux'] = time.perf_counter() - t0
+    count('flux', peb)
+    # as in `Calculator.rates`
+    estimate = pflux.rel_errors + traco.get_ln_traco_error() + table.tol
+
+    ref = barrier.get_rates(betas, pmass)
+    j2k = np.sqrt(2*np.pi*pmass*betas)
+    ln_k = np.log([j_c*j2k, j_q*j2k, j_tot*j2k])
+    errors['k_classic_rel'] = float(np.max(np.abs(np.expm1(ln_k[0] - ref[0]))))
+    errors['k_tunnel_rel'] = float(np.max(np.abs(np.expm1(ln_k[1] - ref[1]))))
+    errors['k_total_rel'] = float(np.max(np.abs(np.expm1(ln_k[2] - ref[2]))))
+
+    for i, label in enumerate(['classic', 'tunnel', 'total']):
+        errors[f'eact_{label}_abs'] = \
+                float(np.max(np.abs(eact[i] - ref[3 + i])))
+
+    # the same in the energy domain
+    t0 = time.perf_counter()
+    j_q, eact_q = pflux.energy(betas, moments=True)[1::3]
+    timings['flux_energy'] = time.perf_counter() - t0
+    errors['k_tunnel_energy_rel'] = float(np.max(np.abs(
+            np.expm1(np.log(j_q*j2k) - ref[1]))))
+    errors['eact_tunnel_energy_abs'] = float(np.max(np.abs(eact_q - ref[4])))
+    estimate_energy = pflux.rel_errors + traco.get_ln_traco_error() + table.tol
+
+    # the numerical errors alone, against a reference on the same spline,
+    # and their ratios to the estimates
+    ref_pflux = PFlux(TransCoeff(peb, pmass, engine=GaussAction(
+            tol=1.0e-12, fallback=AdaptiveAction(rtol=1.0e-12))),
+            table_tol=1.0e-9, flux_rtol=1.0e-10)
+    ref_ln_j_q = ref_pflux.many(betas, log=True)[1]
+    for label, j, est in (('', ln_k[1] - np.log(j2k), estimate),
+                          ('_energy', np.log(j_q), estimate_energy)):
+        err = np.abs(np.expm1(j - ref_ln_j_q))
+        errors[f'k_tunnel{label}_numerical_rel'] = float(np.max(err))
+        errors[f'k_tunnel{label}_estimate_ratio'] = float(np.max(err/est))
+
+    # sensitivities of ln k_total to the data points, against central
+    # differences at a few points
+    zdata, Udata = barrier.get_data(npts)
+    t0 = time.perf_counter()
+    dln_j_c, dln_j_q = get_sensitivities(pflux, betas)
+    timings['sensitivity'] = time.perf_counter() - t0
+    weight = np.exp(ln_k[1] - ln_k[2])[:, None]
+    sens = get_data_sensitivities(peb, zdata,
+                                  (1 - weight)*dln_j_c + weight*dln_j_q)
+
+    # the step must keep the shape of the barrier, e.g., the maximum at
+    # z=0 of flat 'type01' barriers; the table noise is kept below it
+    def get_ln_j(Uvals):
+        pflux = PFlux(TransCoeff(PEB(zdata, Uvals), pmass), table_tol=1.0e-9)
+        return pflux.many(betas, log=True)[2]
+
+    h = 1.0e-7
+    diffs, scale = 0.0, 0.0
+    for i in (0, npts//8, npts//4):
+        dU = np.zeros(npts)
+        dU[i] = h
+        fd = (get_ln_j(Udata + dU) - get_ln_j(Udata - dU)) / (2*h)
+        diffs = max(diffs, np.max(np.abs(sens[:, i] - fd)))
+        scale = max(scale, np.max(np.abs(fd)))
+    errors['dlnk_dU_rel'] = float(diffs/scale)
+
+    timings['total'] = sum(timings.values())
+    return {'timings': timings, 'counts': counts, 'errors': errors}
+
+
+def run_program(barrier, npts, temps, pmass_Da, tmpdir):
+    """Time the whole program on a data file of the barrier."""
+    z, U = barrier.get_data(npts)
+    datafile = os.path.join(tmpdir, f"{barrier.name}_{npts}.dat")
+    np.savetxt(datafile, np.column_stack([z/angst2bohr, U]),
+               header=f"{barrier.name} barrier, {npts} points")
+
+    cmd = [sys.executable, '-m', __package__, datafile, '-m', str(pmass_Da),
+           '-temp'] + [str(t) for t in temps]
+    # the package must be importable by the new interpreter
+    env = dict(os.environ)
+    path = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    env['PYTHONPATH'] = os.pathsep.join(
+            [path] + [p for p in [env.get('PYTHONPATH')] if p])
+    t0 = time.perf_counter()
+    subprocess.run(cmd, check=True, stdout=subprocess.DEVNULL,
+                   stderr=subprocess.DEVNULL, env=env)
+    return time.perf_counter() - t0
+
+
+barriers = [Eckart(), Parabolic(), Gaussian(), DoubleHump()]
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog="benchmark",
+            description="Benchmark and accuracy suite for QTP based on"
+                        " synthetic potential energy barriers.")
+    parser.add_argument('-o', dest='output', metavar="<file>", default=None,
+                        help="JSON report file. (Default: standard output)")
+    parser.add_argument('-m', dest='pmass', metavar="<mass>", type=float,
+                        default=1, help="particle's mass in daltons.")
+    parser.add_argument('-npts', dest='npts', metavar="<number>", type=int,
+                        nargs='+', default=[26, 101, 401],
+                        help="numbers of data points on [0, L].")
+    parser.add_argument('-quick', dest='quick', action='store_true',
+                        help="a single, medium point density.")
+    args = parser.parse_args()
+
+    npts_list = [101] if args.quick else args.npts
+    temps = [100, 700, 50]
+    temps_K = np.arange(*temps)
+
+    report = {
+        'versions': {'python': platform.python_version(),
+                     'numpy': np.__version__,
+                     'scipy': scipy.__version__},
+        'settings': {'pmass_Da': args.pmass, 'temp_K': temps},
+        'cases': {},
+    }
+
+    with tempfile.TemporaryDirectory() as tmpdir:
+        for barrier in barriers:
+            for npts in npts_list:
+                case = run_stages(barrier, npts, temps_K, args.pmass)
+                case['timings']['program'] = \
+                        run_program(barrier, npts, temps, args.pmass, tmpdir)
+                report['cases'][f"{barrier.name}_{npts}"] = case
+                print(f"{barrier.name:>12s} {npts:>6d} points:"
+                      f" {case['timings']['total']:8.3f} s", file=sys.stderr)
+
+    text = json.dumps(report, indent=1, sort_keys=True)
+    if args.output is None:
+        print(text)
+    else:
+        with open(args.output, 'w') as fp:
+            fp.write(text + "\n")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,144 @@
+import hashlib
+import os
+import shutil
+import tempfile
+
+import numpy as np
+
+from .peb import PEBTopology
+from .traco import TracoTable
+
+class Cache(object):
+    """On-disk cache of barrier topologies, action integrals and T(E) tables.
+
+    Each entry is a directory named after the kind of data and a hash of
+    everything the data depend on (the symmetrized barrier, the particle's
+    mass and the numerical tolerances), holding one `.npy` file per array.
+    Entries are loaded with memory-mapping.
+    Whenever an entry is saved, the least recently used entries are evicted
+    until the total size of the cache is below `max_size`.
+
+    Parameters
+    ----------
+    path : str
+        Cache directory; created if it does not exist.
+
+    max_size : int, optional
+        Maximum size of the cache in bytes.
+    """
+
+    def __init__(self, path, max_size=512*2**20):
+        self.path = path
+        self.max_size = max_size
+        os.makedirs(path, exist_ok=True)
+
+    @staticmethod
+    def get_key(*items):
+        """Return a hash of `items` (arrays, numbers or strings)."""
+        sha = hashlib.sha256()
+        for item in items:
+            if isinstance(item, str):
+                sha.update(b's' + item.encode())
+            else:
+                item = np.ascontiguousarray(item, dtype=float)
+                sha.update(b'a' + str(item.shape).encode() + item.tobytes())
+            sha.update(b'\0')
+        return sha.hexdigest()
+
+    def load(self, kind, key):
+        """Return the arrays of an entry as a dict, or None if not cached."""
+        entry = os.path.join(self.path, f"{kind}-{key}")
+        try:
+            arrays = {name[:-4]: np.load(os.path.join(entry, name),
+                                         mmap_mode='r')
+                      for name in os.listdir(entry) if name.endswith('.npy')}
+            os.utime(entry)
+        except OSError:
+            return None
+        return arrays
+
+    def save(self, kind, key, arrays):
+        """Save a dict of arrays as an entry, replacing any previous one."""
+        entry = os.path.join(self.path, f"{kind}-{key}")
+        tmp = tempfile.mkdtemp(dir=self.path, prefix='.tmp-')
+        for name, array in arrays.items():
+            np.save(os.path.join(tmp, f"{name}.npy"), array)
+        # replace the entry as a whole, so that readers never see a partial one
+        if os.path.isdir(entry):
+            shutil.rmtree(entry, ignore_errors=True)
+        try:
+            os.rename(tmp, entry)
+        except OSError:
+            shutil.rmtree(tmp, ignore_errors=True)
+        self.evict()
+
+    def evict(self):
+        """Remove the least recently used entries exceeding `max_size`."""
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            if name.startswith('.') or not os.path.isdir(entry):
+                continue
+            try:
+                size = sum(f.stat().st_size for f in os.scandir(entry))
+                entries.append((os.stat(entry).st_mtime, size, entry))
+            except OSError:
+                continue
+
+        total = sum(size for _, size, _ in entries)
+        for _, size, entry in sorted(entries)[:-1]:
+            if total <= self.max_size:
+                break
+            shutil.rmtree(entry, ignore_errors=True)
+            total -= size
+
+    def _get_peb_key(self, peb):
+        return self.get_key(peb.zvals, peb.Uvals)
+
+    def load_traco(self, traco, table_tol=None):
+        """Load the cached results available for a transmission coefficient.
+
+        The barrier's topology, the action integrals and, if `table_tol` is
+        given, the interpolation table of ln(T(E)) are restored into
+        `traco` (and its PEB).
+
+        Return
+        ------
+        True if the interpolation table was restored.
+        """
+        peb_key = self._get_peb_key(traco.peb)
+
+        arrays = self.load('topology', peb_key)
+        if arrays is not None:
+            traco.peb._topology = PEBTopology.from_arrays(arrays)
+
+        arrays = self.load('actions', self.get_key(peb_key, repr(traco.engine)))
+        if arrays is not None:
+            traco.add_actions(arrays['E'], arrays['action'])
+
+        if table_tol is None:
+            return False
+        arrays = self.load('table', self.get_key(peb_key, repr(traco.engine),
+                                                 traco.pmass, table_tol))
+        if arrays is None:
+            return False
+        traco._table = TracoTable.from_arrays(traco, arrays)
+        return traco._table is not None
+
+    def save_traco(self, traco, table_tol=None):
+        """Save the results calculated for a transmission coefficient.
+
+        See `load_traco`.
+        """
+        peb_key = self._get_peb_key(traco.peb)
+
+        self.save('topology', peb_key, traco.peb.topology.to_arrays())
+
+        Evals, actions = traco.get_actions()
+        self.save('actions', self.get_key(peb_key, repr(traco.engine)),
+                  {'E': Evals, 'action': actions})
+
+        if table_tol is not None and traco._table is not None:
+            self.save('table', self.get_key(peb_key, repr(traco.engine),
+                                            traco.pmass, table_tol),
+                      traco._table.to_arrays())
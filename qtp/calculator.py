@@ -0,0 +1,384 @@
+import warnings
+
+import numpy as np
+
+from .datafile import load_data
+from .peb import PEB
+from .pflux import PFlux
+from .sensitivity import get_data_sensitivities, get_sensitivities
+from .traco import TransCoeff
+from .units import angst2bohr, dalton2me, kelvin2au
+from . import profiling
+
+class Calculator(object):
+    """Quantum transport properties of a particle through a potential barrier.
+
+    The input and output units are those of the program: distances in
+    angstroms, energies in hartrees, masses in daltons and temperatures in
+    kelvin; the remaining quantities are in atomic units.
+
+    Parameters
+    ----------
+    zvals : array-like
+        Distances z from the maximum of the potential energy barrier.
+
+    Uvals : array-like
+        Potential energies U(z); see `PEB` for the preprocessing of the data.
+
+    pmass : float, optional
+        Mass of the tunneling particle.
+
+    executor : concurrent.futures.Executor, optional
+        Pool over which the action integrals are distributed.
+
+    cache : Cache instance, optional
+        Cache from which the results already calculated for the barrier are
+        restored; see `save`.
+
+    settings : Settings instance, optional
+        Numerical settings for a target error of the rate constants; the
+        keyword arguments below take precedence over them.
+        The action integrals, shared by `with_mass`, keep the tolerance
+        derived for `pmass`; the error estimates of `rates` account for it,
+        and a warning is issued where they exceed the target.
+
+    Other parameters
+    ----------------
+    Further keyword arguments are passed on to `TransCoeff` and `PFlux`,
+    e.g., `engine`, `table_tol`, `flux_rtol` and `flux_domain`.
+
+    Attributes
+    ----------
+    peb : PEB instance
+    traco : TransCoeff instance
+    pflux : PFlux instance
+
+    rtol : float or None
+        Target relative error of the rate constants, from `settings`.
+    """
+
+    def __init__(self, zvals, Uvals, pmass=1.0, executor=None, cache=None,
+                 settings=None, **kwargs):
+        if settings is not None:
+            kwargs = {**settings.get_kwargs(pmass), **kwargs}
+        self.rtol = settings.rtol if settings is not None else None
+        self.zvals = np.asarray(zvals, dtype=float)
+        with profiling.timer('stage.peb'):
+            peb = PEB(self.zvals*angst2bohr, Uvals)
+        traco = TransCoeff(peb, pmass*dalton2me, executor=executor, **kwargs)
+        self._setup(traco, cache, kwargs)
+
+    def _setup(self, traco, cache, kwargs):
+        self.peb = traco.peb
+        self.traco = traco
+        self.pflux = PFlux(traco, **kwargs)
+        self.pmass = traco.pmass/dalton2me
+        self.cache = cache
+        self._kwargs = kwargs
+        self._thermal = (None, None)
+        if cache is not None:
+            cache.load_traco(traco, self.pflux.table_tol)
+        self._saved = self._get_progress()
+
+    def _get_progress(self):
+        table = self.traco._table
+        return len(self.traco._actions), table is not None and table.nevals
+
+    @classmethod
+    def from_file(cls, path, pmass=1.0, **kwargs):
+        """Return the calculator for the barrier in the data file `path`.
+
+        See `load_data` for the supported formats.
+        """
+        with profiling.timer('stage.load'):
+            zvals, Uvals = load_data(path)
+        return cls(zvals, Uvals, pmass, **kwargs)
+
+    def with_mass(self, pmass):
+        """Return the calculator for another particle's mass.
+
+        The new calculator shares the barrier and the WKB action integrals
+        with this one (see `TransCoeff.with_mass`).
+        """
+        other = self.__class__.__new__(self.__class__)
+        other.zvals = self.zvals
+        other.rtol = self.rtol
+        other._setup(self.traco.with_mass(pmass*dalton2me), self.cache,
+                     self._kwargs)
+        return other
+
+    def save(self):
+        """Save the results calculated so far into the cache, if any.
+
+        Nothing is written if no results were calculated since the
+        calculator was created or last saved.
+        """
+        progress = self._get_progress()
+        if self.cache is not None and progress != self._saved:
+            self.cache.save_traco(self.traco, self.pflux.table_tol)
+            self._saved = progress
+
+    def local(self, zvals=None, store=True, interpolate=False):
+        """Return the local properties at the distances `zvals`.
+
+        As the barrier is symmetric, U(z) and T(U(z)) are evaluated at |z|,
+        so that the points on opposite branches share one T(E).
+
+        Parameters
+        ----------
+        zvals : array-like, optional
+            Distances in angstroms; the data points by default.
+
+        store : bool, optional
+            Whether the new action integrals are kept (see
+            `TransCoeff.batch`).
+
+        interpolate : bool, optional
+            If True, ln(T(E)) is interpolated from the table of T(E) shared
+            with the rate constants (see `TracoTable`), within its tolerance,
+            instead of calculated at each point; ignored if `table_tol` is
+            None.
+
+        Return
+        ------
+        dict of ndarrays with the keys 'z_angstrom', 'z_bohr', 'U', 'dU_dz',
+        'T' and 'ln_T', where T = T(U(z)).
+        """
+        z_angst = self.zvals if zvals is None else np.asarray(zvals, dtype=float)
+        zcoords = z_angst*angst2bohr
+        with profiling.timer('stage.local'):
+            Us = self.peb(np.abs(zcoords))
+            # the spline may dip below the table's range, E >= 0, between
+            # the data points around its lowest one
+            exact = np.ones(Us.shape, dtype=bool)
+            ln_Ts = np.zeros(Us.shape)
+            if interpolate and self.pflux.table_tol is not None:
+                exact = Us < 0
+                ln_Ts[~exact] = self.traco.get_table(self.pflux.table_tol)(
+                        Us[~exact])
+            ln_Ts[exact] = self.traco.batch(np.abs(zcoords[exact]),
+                                            store=store)[0]
+            Ts = np.exp(ln_Ts)
+            dUs = self.peb(zcoords, der=1)
+        return {'z_angstrom': z_angst,
+                'z_bohr': zcoords,
+                'U': Us,
+                'dU_dz': dUs,
+                'T': Ts,
+                'ln_T': ln_Ts}
+
+    def iter_local(self, zrange, chunk_size=65536):
+        """Yield the local properties on an evenly spaced grid, in chunks.
+
+        The grid is generated chunk by chunk, so that the memory does not
+        depend on the number of points.
+        ln(T(E)) is interpolated from the table of T(E) (see `local`), whose
+        few hundred action integrals serve the whole profile and the rate
+        constants; without a table, the action integrals of the profile are
+        calculated at each point and not kept.
+
+        Parameters
+        ----------
+        zrange : sequence of 3 floats
+            Lower limit, upper limit and step in angstroms, as in `np.arange`.
+
+        chunk_size : int, optional
+            Number of points of each chunk.
+
+        Yield
+        -----
+        dict of ndarrays for each chunk, as returned by `local`.
+        """
+        start, stop, step = zrange
+        assert step != 0, "The step of the z grid must not be zero."
+        npts = max(int(np.ceil((stop - start) / step)), 0)
+        # the points of `np.arange`, which steps by (start + step) - start
+        delta = (start + step) - start
+        for i0 in range(0, npts, chunk_size):
+            idx = np.arange(i0, min(i0 + chunk_size, npts))
+            yield self.local(start + idx*delta, store=False, interpolate=True)
+
+    def _get_thermal(self, temps_K):
+        """Return the fluxes and activation energies for `temps_K`.
+
+        The results for the last temperatures are kept, as both `rates` and
+        `arrhenius` need them.
+        """
+        temps_K = np.array(temps_K, dtype=float, ndmin=1)
+        key, results = self._thermal
+        if key is not None and np.array_equal(key, temps_K):
+            return results
+
+        results = self._calc_thermal(temps_K)
+        self._thermal = (temps_K, results)
+        return results
+
+    def _calc_thermal(self, temps_K):
+        betas = 1/(temps_K*kelvin2au)
+        # the activation energies come from the same integrals as the fluxes;
+        # the logarithms of the fluxes do not underflow at low temperatures
+        with profiling.timer('stage.flux'):
+            fluxes = self.pflux.many(betas, moments=True, log=True)
+        for t, beta, ln_j, err in zip(temps_K, betas, fluxes[1],
+                                      self.pflux.errors):
+            profiling.record('flux.per_temperature', pmass_Da=self.pmass,
+                             temp_K=t, beta=beta, j_tunnel=np.exp(ln_j),
+                             error=err)
+        # the errors of ln(T(E)) are relative errors of T(E), thus of j_q
+        rel_error = self.pflux.rel_errors + self.traco.get_ln_traco_error()
+        if self.pflux.table_tol is not None:
+            rel_error += self.traco.get_table(self.pflux.table_tol).tol
+        if self.rtol is not None and np.max(rel_error) > self.rtol:
+            warnings.warn("Calculator: the estimated relative error of k,"
+                          f" {np.max(rel_error):.1e}, exceeds the target"
+                          f" rtol={self.rtol}.")
+        return (temps_K, betas) + fluxes + (rel_error,)
+
+    def refine_temps(self, temps_K, tol=1.0e-3, max_temps=100):
+        """Return a temperature grid on which ln k(beta) is resolved.
+
+        Starting from the temperatures `temps_K`, each interval between
+        consecutive temperatures is checked at its midpoint in beta: there,
+        the cubic Hermite interpolant of ln k through the ends of the interval,
+        where the slopes are d ln(k)/d(beta) = -Eact, is compared with the
+        calculated value.
+        The intervals where the interpolant of any of the classical, tunneling
+        and total rate constants misses by more than `tol` are bisected, and
+        their halves are checked in the next sweep.
+        All the midpoints of a sweep are calculated together; the refinement
+        stops when all intervals pass or `max_temps` temperatures have been
+        calculated.
+        The results are kept for `rates` and `arrhenius`.
+
+        Return
+        ------
+        ndarray with all the calculated temperatures in ascending order.
+        """
+        temps_K = np.unique(np.asarray(temps_K, dtype=float))
+        results = [self._calc_thermal(temps_K)]
+
+        def get_ln_k(res):
+            temps, betas, *ln_j, eact_c, eact_q, eact_tot, _ = res
+            ln_k = np.array(ln_j) + 0.5*np.log(2*np.pi*self.traco.pmass*betas)
+            return betas, ln_k, -np.array([eact_c, eact_q, eact_tot])
+
+        betas, ln_k, slopes = get_ln_k(results[0])
+        # intervals to check, as indices of their ends
+        panels = np.column_stack([np.arange(len(betas) - 1),
+                                  np.arange(1, len(betas))])
+
+        while len(panels) and len(betas) < max_temps:
+            # within the budget, the widest intervals are checked first
+            if len(panels) > max_temps - len(betas):
+                width = np.abs(betas[panels[:, 1]] - betas[panels[:, 0]])
+                order = np.argsort(width)[::-1]
+                panels = panels[order[:max_temps - len(betas)]]
+
+            i0, i1 = panels.T
+            h = betas[i1] - betas[i0]
+            res = self._calc_thermal(2/(betas[i0] + betas[i1])/kelvin2au)
+            results.append(res)
+            new_betas, new_ln_k, new_slopes = get_ln_k(res)
+
+            hermite = 0.5*(ln_k[:, i0] + ln_k[:, i1]) \
+                    + 0.125*h*(slopes[:, i0] - slopes[:, i1])
+            with np.errstate(invalid='ignore'):
+                failed = (np.abs(hermite - new_ln_k) > tol).any(axis=0)
+
+            imid = len(betas) + np.arange(len(panels))
+            betas = np.concatenate([betas, new_betas])
+            ln_k = np.concatenate([ln_k, new_ln_k], axis=1)
+            slopes = np.concatenate([slopes, new_slopes], axis=1)
+            panels = np.concatenate([
+                    np.column_stack([i0[failed], imid[failed]]),
+                    np.column_stack([imid[failed], i1[failed]])])
+        profiling.count('temps.refined', len(betas))
+
+        # all results, in ascending order of temperature
+        results = [np.concatenate(r) for r in zip(*results)]
+        order = np.argsort(results[0])
+        results = tuple(r[order] for r in results)
+        self._thermal = (results[0], results)
+        return results[0]
+
+    def rates(self, temps_K):
+        """Return the fluxes and rate constants at the temperatures `temps_K`.
+
+        Return
+        ------
+        dict of ndarrays with the keys 'temp_K', 'inv_temp_K', 'beta' and, for
+        each of the components 'classic', 'tunnel' and 'total', 'k_<comp>',
+        'flux_<comp>' and 'ln_k_<comp>'; and 'k_rel_error', the estimated
+        relative error of k_tunnel, which also bounds that of k_total, as
+        k_classic is calculated in closed form.
+        The logarithms of the rate constants are calculated as such, so that
+        they are finite even where the rate constants underflow.
+        """
+        thermal = self._get_thermal(temps_K)
+        temps_K, betas, *ln_j = thermal[:5]
+        ln_j2k = 0.5*np.log(2*np.pi*self.traco.pmass*betas)
+        ln_j_c, ln_j_q, ln_j_tot = ln_j
+        return {'temp_K': temps_K,
+                'inv_temp_K': 1/temps_K,
+                'beta': betas,
+                'k_classic': np.exp(ln_j_c + ln_j2k),
+                'k_tunnel': np.exp(ln_j_q + ln_j2k),
+                'k_total': np.exp(ln_j_tot + ln_j2k),
+                'flux_classic': np.exp(ln_j_c),
+                'flux_tunnel': np.exp(ln_j_q),
+                'flux_total': np.exp(ln_j_tot),
+                'ln_k_classic': ln_j_c + ln_j2k,
+                'ln_k_tunnel': ln_j_q + ln_j2k,
+                'ln_k_total': ln_j_tot + ln_j2k,
+                'k_rel_error': thermal[8]}
+
+    def sensitivities(self, temps_K):
+        """Return the derivatives of ln k with respect to the data points.
+
+        The derivatives with respect to all the potential energies U(z) of
+        the data cost about as much as one evaluation of the rate constants;
+        see `qtp.sensitivity` for the method.
+
+        Return
+        ------
+        dict of ndarrays with the keys 'temp_K', 'z_angstrom' and, for each
+        of the components 'classic', 'tunnel' and 'total', 'dlnk_dU_<comp>',
+        with shape (len(temps_K), len(z_angstrom)) and in 1/hartree.
+        """
+        temps_K, betas, *ln_j = self._get_thermal(temps_K)[:5]
+        ln_j_c, ln_j_q, ln_j_tot = ln_j
+        with profiling.timer('stage.sensitivity'):
+            dln_j_c, dln_j_q = get_sensitivities(self.pflux, betas)
+        weight = np.exp(ln_j_q - ln_j_tot)[:, None]
+        sens = [dln_j_c, dln_j_q, (1 - weight)*dln_j_c + weight*dln_j_q]
+        zcoords = self.zvals*angst2bohr
+        results = {'temp_K': temps_K, 'z_angstrom': self.zvals}
+        for comp, d in zip(['classic', 'tunnel', 'total'], sens):
+            results[f'dlnk_dU_{comp}'] = get_data_sensitivities(self.peb,
+                                                                zcoords, d)
+        return results
+
+    def arrhenius(self, temps_K):
+        """Return the Arrhenius parameters at the temperatures `temps_K`.
+
+        The activation energies, Eact = -d ln(k)/d(beta), and the coefficients,
+        A = k * exp(beta * Eact), are local to each temperature.
+
+        Return
+        ------
+        dict of ndarrays with the keys 'temp_K', 'inv_temp_K', 'beta' and, for
+        each of the components 'classic', 'tunnel' and 'total', 'Eact_<comp>'
+        and 'coeff_<comp>'.
+        """
+        rates = self.rates(temps_K)
+        temps_K, betas = rates['temp_K'], rates['beta']
+        eact_c, eact_q, eact_tot = self._get_thermal(temps_K)[5:8]
+        return {'temp_K': temps_K,
+                'inv_temp_K': 1/temps_K,
+                'beta': betas,
+                'Eact_classic': eact_c,
+                'Eact_tunnel': eact_q,
+                'Eact_total': eact_tot,
+                'coeff_classic': np.exp(rates['ln_k_classic'] + betas*eact_c),
+                'coeff_tunnel': np.exp(rates['ln_k_tunnel'] + betas*eact_q),
+                'coeff_total': np.exp(rates['ln_k_total'] + betas*eact_tot)}
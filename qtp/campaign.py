@@ -0,0 +1,325 @@
+"""Screening campaigns over many barriers, masses and temperature ranges.
+
+Usage: python -m qtp.campaign <manifest> [-db <file>] [-jobs <n>]
+
+The manifest is a JSON file such as::
+
+    {"data": ["barriers/*.dat", "defects/site_?.npy"],
+     "masses": [1, 2, 3],
+     "temps": [[100, 1000, 50], [300]],
+     "temptol": null,
+     "maxtemps": 100,
+     "preset": "fast"}
+
+where `data` holds glob patterns of data files, relative to the manifest's
+folder, and each item of `temps` is specified as in `-temp`; `temptol`,
+`maxtemps` and `preset` (optional) are as in the program's options.
+Every combination of data file, mass and temperatures is a job.
+The jobs of each data file run together in a worker process, which shares
+the barrier and its WKB action integrals among the masses.
+
+The results are written to a SQLite database as soon as all jobs of a data
+file are done.
+Running a campaign again skips the jobs already done, e.g., after an
+interruption or when data files are added; failed jobs, and jobs whose data
+file has changed, are run again.
+The database holds the tables
+
+* `jobs`: job_id, datafile, data_hash, pmass_Da, temps, options, status
+  ('done' or 'failed'), error, seconds, and the barrier's Umax, U0 and
+  peb_type;
+* `results`: job_id and the columns of the 'rates' and 'arrhenius' tables,
+  one row per temperature (the databases of earlier versions gain the new
+  columns, empty for the jobs already done);
+
+and the view `campaign`, which joins both.
+"""
+import argparse
+import concurrent.futures
+import glob
+import hashlib
+import json
+import os
+import sqlite3
+import sys
+import time
+
+import numpy as np
+
+from .calculator import Calculator
+from .cmdline import get_temps
+from .settings import Settings
+
+columns = ['temp_K', 'inv_temp_K', 'beta',
+           'k_classic', 'k_tunnel', 'k_total',
+           'flux_classic', 'flux_tunnel', 'flux_total',
+           'Eact_classic', 'Eact_tunnel', 'Eact_total',
+           'coeff_classic', 'coeff_tunnel', 'coeff_total', 'k_rel_error']
+
+_schema = f"""
+CREATE TABLE IF NOT EXISTS jobs (
+    job_id INTEGER PRIMARY KEY,
+    datafile TEXT NOT NULL,
+    data_hash TEXT NOT NULL,
+    pmass_Da REAL NOT NULL,
+    temps TEXT NOT NULL,
+    options TEXT NOT NULL,
+    status TEXT NOT NULL,
+    error TEXT,
+    seconds REAL,
+    Umax REAL,
+    U0 REAL,
+    peb_type TEXT,
+    UNIQUE (datafile, data_hash, pmass_Da, temps, options)
+);
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER NOT NULL REFERENCES jobs (job_id),
+    {', '.join(f'{c} REAL' for c in columns)}
+);
+CREATE INDEX IF NOT EXISTS results_job ON results (job_id);
+CREATE VIEW IF NOT EXISTS campaign AS
+    SELECT datafile, pmass_Da, temps, options, Umax, U0, peb_type, results.*
+    FROM jobs JOIN results USING (job_id)
+    WHERE status = 'done';
+"""
+
+def get_hash(path):
+    """Return the SHA-256 digest of the contents of the file `path`."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as fp:
+        for block in iter(lambda: fp.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+def read_manifest(path):
+    """Return the jobs specified by the manifest file `path`.
+
+    Return
+    ------
+    dict mapping each data file to its list of (mass, temperatures) jobs,
+    where the temperatures are given as a JSON list as in `-temp`; and the
+    options of all jobs, as a dict.
+    """
+    with open(path) as fp:
+        manifest = json.load(fp)
+    root = os.path.dirname(os.path.abspath(path))
+
+    datafiles = []
+    for pattern in manifest['data']:
+        found = sorted(glob.glob(os.path.join(root, pattern)))
+        assert found, f"No data files match `{pattern}`."
+        datafiles += [f for f in found if f not in datafiles]
+
+    temps = [json.dumps([float(t) for t in spec])
+             for spec in manifest.get('temps', [[300]])]
+    jobs = [(float(m), t) for m in manifest.get('masses', [1]) for t in temps]
+    options = {'temptol': manifest.get('temptol'),
+               'maxtemps': manifest.get('maxtemps', 100)}
+    # the options of the jobs without a preset are unchanged, so that they
+    # are found in the databases of earlier versions
+    if manifest.get('preset') is not None:
+        options['preset'] = manifest['preset']
+    return {f: list(jobs) for f in datafiles}, options
+
+def run_datafile(datafile, jobs, options, cache_path=None):
+    """Run the jobs of a data file (in a worker process).
+
+    Return
+    ------
+    list with a dict for each job, holding its 'status', 'error',
+    'seconds', the barrier's 'Umax', 'U0' and 'peb_type', and the
+    'results' as a dict of arrays.
+    """
+    cache = None
+    if cache_path is not None:
+        from .cache import Cache
+        cache = Cache(cache_path)
+
+    settings = None
+    if options.get('preset') is not None:
+        settings = Settings.preset(options['preset'])
+
+    calc = None
+    done = []
+    for pmass, temps in jobs:
+        t0 = time.perf_counter()
+        job = {'status': 'failed', 'error': None, 'results': None,
+               'Umax': None, 'U0': None, 'peb_type': None}
+        try:
+            if calc is None:
+                calc = Calculator.from_file(datafile, pmass, cache=cache,
+                                            settings=settings)
+            else:
+                calc = calc.with_mass(pmass)
+            topo = calc.peb.topology
+            job.update(Umax=float(topo.Umax), U0=float(topo.U0),
+                       peb_type=str(topo.peb_type))
+
+            temps_K = get_temps(json.loads(temps))
+            if options['temptol'] is not None:
+                temps_K = calc.refine_temps(temps_K, options['temptol'],
+                                            options['maxtemps'])
+            job['results'] = {**calc.rates(temps_K), **calc.arrhenius(temps_K)}
+            job['status'] = 'done'
+            calc.save()
+        except Exception as err:
+            job['error'] = f"{err.__class__.__name__}: {err}"
+        job['seconds'] = time.perf_counter() - t0
+        done.append(job)
+    return done
+
+
+class Campaign(object):
+    """Campaign of jobs with its results in a SQLite database.
+
+    Parameters
+    ----------
+    manifest : str
+        Path of the manifest file (see the module's documentation).
+
+    database : str
+        Path of the SQLite database; it is created if necessary.
+    """
+
+    def __init__(self, manifest, database):
+        self.jobs, self.options = read_manifest(manifest)
+        self.options_key = json.dumps(self.options, sort_keys=True)
+        self.con = sqlite3.connect(database)
+        self.con.executescript(_schema)
+        known = [row[1] for row in
+                 self.con.execute("PRAGMA table_info(results)")]
+        with self.con:
+            for c in columns:
+                if c not in known:
+                    self.con.execute(f"ALTER TABLE results ADD COLUMN {c} REAL")
+
+    def get_pending(self):
+        """Return the jobs not done yet, grouped by data file.
+
+        Return
+        ------
+        list of (datafile, data_hash, jobs) tuples.
+        """
+        pending = []
+        for datafile, jobs in self.jobs.items():
+            data_hash = get_hash(datafile)
+            done = set(self.con.execute(
+                    "SELECT pmass_Da, temps FROM jobs WHERE datafile = ?"
+                    " AND data_hash = ? AND options = ? AND status = 'done'",
+                    (datafile, data_hash, self.options_key)))
+            todo = [job for job in jobs if job not in done]
+            if todo:
+                pending.append((datafile, data_hash, todo))
+        return pending
+
+    def store(self, datafile, data_hash, jobs, results):
+        """Write the results of the jobs of a data file (in one transaction)."""
+        with self.con:
+            for (pmass, temps), res in zip(jobs, results):
+                key = (datafile, data_hash, pmass, temps, self.options_key)
+                row = self.con.execute(
+                        "SELECT job_id FROM jobs WHERE datafile = ?"
+                        " AND data_hash = ? AND pmass_Da = ? AND temps = ?"
+                        " AND options = ?", key).fetchone()
+                values = (res['status'], res['error'], res['seconds'],
+                          res['Umax'], res['U0'], res['peb_type'])
+                if row is None:
+                    job_id = self.con.execute(
+                            "INSERT INTO jobs (datafile, data_hash, pmass_Da,"
+                            " temps, options, status, error, seconds, Umax,"
+                            " U0, peb_type) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?,"
+                            " ?, ?)", key + values).lastrowid
+                else:
+                    job_id = row[0]
+                    self.con.execute(
+                            "UPDATE jobs SET status = ?, error = ?,"
+                            " seconds = ?, Umax = ?, U0 = ?, peb_type = ?"
+                            " WHERE job_id = ?", values + (job_id,))
+                    self.con.execute("DELETE FROM results WHERE job_id = ?",
+                                     (job_id,))
+                if res['results'] is not None:
+                    data = np.column_stack([res['results'][c] for c in columns])
+                    self.con.executemany(
+                            f"INSERT INTO results VALUES"
+                            f" ({', '.join((len(columns) + 1)*'?')})",
+                            [(job_id, *map(float, r)) for r in data])
+
+    def run(self, jobs=1, cache=None, log=sys.stderr):
+        """Run all pending jobs over `jobs` worker processes.
+
+        Return
+        ------
+        Number of failed jobs.
+        """
+        pending = self.get_pending()
+        total = sum(len(todo) for _, _, todo in pending)
+        skipped = sum(len(j) for j in self.jobs.values()) - total
+        print(f"{total} jobs to run ({skipped} already done)", file=log)
+
+        nfailed = ndone = 0
+        with concurrent.futures.ProcessPoolExecutor(jobs) as executor:
+            futures = {executor.submit(run_datafile, datafile, todo,
+                                       self.options, cache):
+                       (datafile, data_hash, todo)
+                       for datafile, data_hash, todo in pending}
+            try:
+                for future in concurrent.futures.as_completed(futures):
+                    datafile, data_hash, todo = futures[future]
+                    results = future.result()
+                    self.store(datafile, data_hash, todo, results)
+                    for (pmass, temps), res in zip(todo, results):
+                        ndone += 1
+                        nfailed += res['status'] != 'done'
+                        print(f"[{ndone}/{total}] {datafile} m={pmass:g}"
+                              f" T={temps}: {res['status']}"
+                              f" ({res['seconds']:.2f} s)"
+                              + (f" {res['error']}" if res['error'] else ""),
+                              file=log)
+            except KeyboardInterrupt:
+                executor.shutdown(cancel_futures=True)
+                raise
+        return nfailed
+
+    def close(self):
+        self.con.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog="qtp.campaign",
+            description="Run a screening campaign over many barriers, masses"
+                        " and temperatures; the jobs already done are"
+                        " skipped.")
+    parser.add_argument('manifest', metavar="<manifest>",
+                        help="JSON file describing the campaign.")
+    parser.add_argument('-db', dest='database', metavar="<file>",
+                        default=None,
+                        help="SQLite database with the results."
+                             " (Default: the manifest's name with the"
+                             " `.sqlite` extension)")
+    parser.add_argument('-jobs', dest='jobs', metavar="<number>", type=int,
+                        default=1,
+                        help="number of worker processes. (Default: 1)")
+    parser.add_argument('-cache', dest='cache', metavar="<dir>",
+                        default=os.environ.get('QTP_CACHE'),
+                        help="directory of the on-disk cache."
+                             " (Default: $QTP_CACHE, if set)")
+    args = parser.parse_args()
+
+    database = args.database
+    if database is None:
+        database = os.path.splitext(args.manifest)[0] + '.sqlite'
+
+    campaign = Campaign(args.manifest, database)
+    try:
+        nfailed = campaign.run(args.jobs, args.cache)
+    except KeyboardInterrupt:
+        print("Interrupted; run the campaign again to resume.", file=sys.stderr)
+        sys.exit(130)
+    finally:
+        campaign.close()
+    sys.exit(1 if nfailed else 0)
+
+
+if __name__ == '__main__':
+    main()
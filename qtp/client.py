@@ -0,0 +1,108 @@
+"""Minimal client of the QTP server, to exercise it and time its responses.
+
+Usage: python -m qtp.client <datafile> [-socket <path>] [-n <number>]
+
+Without `-socket`, a server is started as a subprocess, which reads the
+requests from its standard input.
+A few requests are sent for the barrier in <datafile> and their response
+times are printed.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import numpy as np
+
+class Client(object):
+    """Client of a QTP server (see the `server` module).
+
+    Parameters
+    ----------
+    path : str, optional
+        Unix socket of a running server.
+        If None, a server is started as a subprocess.
+
+    args : list of str, optional
+        Command-line arguments of the server started as a subprocess.
+    """
+
+    def __init__(self, path=None, args=()):
+        self.process = None
+        if path is None:
+            # the package must be importable by the new interpreter
+            env = dict(os.environ)
+            pkgpath = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+            env['PYTHONPATH'] = os.pathsep.join(
+                    [pkgpath] + [p for p in [env.get('PYTHONPATH')] if p])
+            self.process = subprocess.Popen(
+                    [sys.executable, '-m', f"{__package__}.server", *args],
+                    stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True,
+                    env=env)
+            self._reader, self._writer = self.process.stdout, self.process.stdin
+        else:
+            self._socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            self._socket.connect(path)
+            self._reader = self._writer = self._socket.makefile('rw')
+        self._id = 0
+
+    def request(self, method, **params):
+        """Send a request and return its result (see the `server` module)."""
+        self._id += 1
+        self._writer.write(json.dumps({'id': self._id, 'method': method,
+                                       **params}) + "\n")
+        self._writer.flush()
+        response = json.loads(self._reader.readline())
+        assert response['id'] == self._id, \
+                f"Unexpected response: {response}"
+        assert 'error' not in response, response.get('error')
+        return response['result']
+
+    def close(self):
+        if self.process is not None:
+            self.process.stdin.close()
+            self.process.wait()
+        else:
+            self._socket.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog="qtp.client",
+            description="Send a few requests to a QTP server and print"
+                        " their response times.")
+    parser.add_argument('datafile', metavar="<datafile>",
+                        help="potential energy barrier's data file.")
+    parser.add_argument('-socket', dest='socket', metavar="<path>",
+                        default=None,
+                        help="Unix socket of a running server."
+                             " (Default: start a server)")
+    parser.add_argument('-n', dest='n', metavar="<number>", type=int,
+                        default=20, help="number of warm requests.")
+    args = parser.parse_args()
+
+    client = Client(args.socket)
+    datafile = os.path.abspath(args.datafile)
+
+    def timed(method, **params):
+        t0 = time.perf_counter()
+        client.request(method, datafile=datafile, **params)
+        return 1e3*(time.perf_counter() - t0)
+
+    print(f"{'request':<28s}  {'time/ms':>10s}")
+    print(f"{'rates (cold)':<28s}  {timed('rates', temps_K=[300]):>10.2f}")
+    for method, params in [('rates', lambda t: {'temps_K': [t]}),
+                           ('arrhenius', lambda t: {'temps_K': [t]}),
+                           ('local', lambda t: {'z': [t/1000, t/500]})]:
+        times = [timed(method, **params(t))
+                 for t in np.linspace(150, 450, args.n)]
+        print(f"{method + ' (warm, median)':<28s}  {np.median(times):>10.2f}")
+        print(f"{method + ' (warm, max)':<28s}  {np.max(times):>10.2f}")
+    client.close()
+
+
+if __name__ == '__main__':
+    main()
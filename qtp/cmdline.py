@@ -1,4 +1,7 @@
 import argparse
+import os
+
+import numpy as np
 
 __description = (
         "This estimates quantum tunneling properties of an particle"
@@ -34,12 +37,19 @@ parser.add_argument('datafile', metavar="<file>", type=str,
                           " distances in 'angstroms'."
                           " Note that `z` can be negative, depending on"
                           " whether the atom is above or below the surface."
-                          " Furthermore, lines starting with `#` will be"
-                          " ignored by the parser."))
+                          " Furthermore, anything after a `#` will be"
+                          " ignored by the parser."
+                          " Alternatively, a NumPy `.npy` file with the two"
+                          " columns can be given, which is memory-mapped."))
 
-parser.add_argument('-m', dest='pmass', metavar="<mass>", type=float, default=1,
+parser.add_argument('-m', dest='pmass', metavar="<mass>", type=float,
+                    default=[1], nargs='+',
                     help=("mass of the tunneling particle in 'daltons'"
-                          " (1 Da = 1 g/mol). (Default: 1 Da)"))
+                          " (1 Da = 1 g/mol)."
+                          " Several masses can be given to study a series of"
+                          " isotopes, e.g., `-m 1 2 3`; in this case, the"
+                          " kinetic isotope effects relative to the first"
+                          " mass are also printed. (Default: 1 Da)"))
 
 parser.add_argument('-temp', dest='temp', metavar="<temperature>",
                     type=float, default=[300], nargs='*',
@@ -51,6 +61,43 @@ parser.add_argument('-temp', dest='temp', metavar="<temperature>",
                           " temperatures in the interval [300 K, 800 K)"
                           " at steps of 10 K."))
 
+parser.add_argument('-temptol', dest='temptol', metavar="<tolerance>",
+                    type=float, default=None,
+                    help=("refine the temperatures given by `-temp`"
+                          " adaptively: temperatures are inserted (at the"
+                          " midpoints in 1/T) wherever ln(k) is not"
+                          " reproduced within <tolerance> by its cubic"
+                          " interpolation in 1/T, e.g., around the crossover"
+                          " from classical to tunneling behaviour."
+                          " The grid is refined for the first mass and used"
+                          " for all masses. (Default: no refinement)"))
+
+parser.add_argument('-maxtemps', dest='maxtemps', metavar="<number>",
+                    type=int, default=100,
+                    help=("maximum number of temperatures of the adaptive"
+                          " refinement (see `-temptol`). (Default: 100)"))
+
+parser.add_argument('-flux', dest='flux_domain', choices=['z', 'energy'],
+                    default='z',
+                    help=("integration variable of the tunneling flux:"
+                          " the distance z, on a composite Gauss-Legendre"
+                          " grid shared by all temperatures, or the energy,"
+                          " on a few dozen nodes per temperature placed"
+                          " around the maximum of T(E) exp(-E/kT)."
+                          " The rate constants of both agree within a"
+                          " relative error of ca. 1e-5. (Default: z)"))
+
+parser.add_argument('-preset', dest='preset',
+                    choices=['fast', 'default', 'tight'], default=None,
+                    help=("numerical settings for a target relative error"
+                          " of the rate constants of 1e-3 (fast), 2e-6"
+                          " (default) or 1e-8 (tight), split among the"
+                          " action integrals, the table of T(E) and the"
+                          " flux integral; the estimated error of each"
+                          " temperature is printed with the rates."
+                          " (Default: the fixed tolerances of the program,"
+                          " close to those of `default` for protium)"))
+
 parser.add_argument('-zrange', dest='zrange_angst', metavar="<value>",
                     type=float, nargs=3, default=None, required=False,
                     help=("range of coordinates for which local"
@@ -68,8 +115,97 @@ parser.add_argument('-zrange', dest='zrange_angst', metavar="<value>",
                           " smoother curve by specifying a finer z step to"
                           " interpolate between the input points.)"))
 
+parser.add_argument('-ensemble', dest='ensemble', metavar="<size>",
+                    type=int, default=None,
+                    help=("number of barriers perturbed from the input data"
+                          " (see `-noise` and `-resample`) whose rate"
+                          " constants and activation energies are summarized"
+                          " by percentile bands at each temperature."
+                          " The members are distributed over the `-jobs`"
+                          " workers in batches. (Default: no ensemble)"))
+
+parser.add_argument('-noise', dest='noise', metavar="<hartree>", type=float,
+                    default=0.0,
+                    help=("standard deviation of the Gaussian noise added to"
+                          " the potential energies of the ensemble's"
+                          " members. (Default: 0)"))
+
+parser.add_argument('-resample', dest='resample', action='store_true',
+                    help=("draw the data points of the ensemble's members"
+                          " with replacement from the input ones (bootstrap);"
+                          " the outermost points are always kept."))
+
+parser.add_argument('-seed', dest='seed', metavar="<number>", type=int,
+                    default=0,
+                    help=("seed of the ensemble's random numbers; the"
+                          " results do not depend on `-jobs`. (Default: 0)"))
+
+parser.add_argument('-percentiles', dest='percentiles', metavar="<value>",
+                    type=float, nargs='+', default=[2.5, 50, 97.5],
+                    help=("percentiles of the ensemble's bands."
+                          " (Default: 2.5 50 97.5)"))
+
+parser.add_argument('-jobs', dest='jobs', metavar="<number>", type=int,
+                    default=1,
+                    help=("number of worker processes used to evaluate the"
+                          " transmission coefficients."
+                          " The results do not depend on this number."
+                          " (Default: 1)"))
+
+parser.add_argument('-cache', dest='cache', metavar="<directory>", type=str,
+                    default=os.environ.get('QTP_CACHE'),
+                    help=("directory where the barrier's topology, the WKB"
+                          " action integrals and the tables of T(E) are"
+                          " cached for later runs on the same data."
+                          " (Default: $QTP_CACHE, if set; otherwise, no"
+                          " cache is used)"))
+
+parser.add_argument('-cachesize', dest='cachesize', metavar="<size>",
+                    type=float, default=512,
+                    help=("maximum size of the cache in megabytes; the least"
+                          " recently used entries are removed beyond this"
+                          " size. (Default: 512 MB)"))
+
+parser.add_argument('-o', '--output', dest='output', metavar="<file>",
+                    type=str, default=None,
+                    help=("file where the results are written."
+                          " (Default: standard output)"))
+
+parser.add_argument('-format', '--format', dest='format',
+                    choices=['text', 'csv', 'npz', 'jsonl'], default='text',
+                    help=("format of the result tables: human-readable text,"
+                          " comma-separated values (one file per table if"
+                          " `-o` is given), a NumPy `.npz` archive (requires"
+                          " `-o`), or JSON lines (one object per row)."
+                          " (Default: text)"))
+
+parser.add_argument('-profile', '--profile', dest='profile', metavar="<file>",
+                    nargs='?', const='-', default=None,
+                    help=("collect timings and counts of integrand"
+                          " evaluations, quadratures, spline constructions"
+                          " and root searches for each stage of the"
+                          " calculation. The summary is printed to the"
+                          " standard error, or written as JSON to <file>."))
+
+def get_temps(values):
+    """Return the temperatures specified as in `-temp`."""
+    if len(values) == 1:
+        return list(values)
+    elif len(values) == 3:
+        return list(np.arange(*values))
+    else:
+        raise AssertionError(f"Invalid temperature input:"
+                             f" {' '.join(str(v) for v in values)}")
+
+def parse_args(argv=None):
+    """Return the parsed arguments; invalid combinations exit as usage errors."""
+    args = parser.parse_args(argv)
+    if args.format == 'npz' and args.output is None:
+        parser.error("-format npz requires -o")
+    return args
+
 def main():
-    return parser.parse_args()
+    return parse_args()
 
 if __name__ == "__main__":
     args = main()
@@ -0,0 +1,24 @@
+import numpy as np
+
+def load_data(path):
+    """Read the z and U(z) columns of a potential energy barrier file.
+
+    Parameters
+    ----------
+    path : str
+        Either a text file in XY format, i.e., `z` values in the first column
+        and the corresponding energies in the second column, where anything
+        after a `#` is ignored; or a NumPy `.npy` file holding an array with
+        shape (n, 2), which is memory-mapped instead of read.
+
+    Return
+    ------
+    zvals, Uvals : ndarrays
+    """
+    if path.endswith('.npy'):
+        data = np.load(path, mmap_mode='r')
+    else:
+        data = np.loadtxt(path, comments='#', usecols=(0, 1), ndmin=2)
+    assert data.ndim == 2 and data.shape[1] == 2, \
+            f"Invalid data in `{path}`: two columns (z and U(z)) are expected."
+    return data[:, 0], data[:, 1]
@@ -0,0 +1,170 @@
+"""Uncertainty of the rate constants from ensembles of perturbed barriers.
+
+The members of an ensemble are variants of the input data points, either
+with Gaussian noise added to the potential energies or resampled with
+replacement (bootstrap); their rate constants and activation energies are
+summarized by percentile bands at each temperature.
+
+Each member is drawn from its own random stream, spawned from the seed of
+the ensemble, so that the members, and thus the bands, do not depend on the
+batches or on the number of worker processes.
+Within a batch, the members share the action engine and its quadrature
+rules, the flux rules in energy and the inverse temperatures, and the
+isotopes of each member share its action integrals (see
+`Calculator.with_mass`).
+"""
+import functools
+import warnings
+
+import numpy as np
+
+from .action import GaussAction
+from .calculator import Calculator
+
+class Ensemble(object):
+    """Ensemble of barriers perturbed from the input data points.
+
+    Parameters
+    ----------
+    zvals : array-like
+        Distances in angstroms of the data points.
+
+    Uvals : array-like
+        Potential energies in hartrees of the data points.
+
+    size : int
+        Number of members.
+
+    noise : float, optional
+        Standard deviation in hartrees of the Gaussian noise added to each
+        potential energy. As the barrier is symmetrized, the noise of the
+        points with the same |z| is averaged.
+
+    resample : bool, optional
+        Whether the data points of each member are drawn with replacement
+        from the input ones; the outermost points are always kept, so that
+        all the members span the same range of z.
+
+    seed : int, optional
+        Seed of the random streams of the members.
+    """
+
+    keys = ['ln_k_tunnel', 'ln_k_total', 'Eact_tunnel', 'Eact_total']
+
+    def __init__(self, zvals, Uvals, size, noise=0.0, resample=False, seed=0):
+        assert size >= 1, f"Invalid size of the ensemble: {size}"
+        assert noise >= 0, f"Invalid noise: {noise}"
+        self.zvals = np.asarray(zvals, dtype=float)
+        self.Uvals = np.asarray(Uvals, dtype=float)
+        self.size = size
+        self.noise = noise
+        self.resample = resample
+        self.seed = seed
+        self._streams = np.random.SeedSequence(seed).spawn(size)
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(size={self.size!r}, "
+                f"noise={self.noise!r}, resample={self.resample!r}, "
+                f"seed={self.seed!r})")
+
+    def get_member(self, i):
+        """Return the data points (z in angstroms, U in hartrees) of member `i`."""
+        assert 0 <= i < self.size, f"Invalid member: {i}"
+        rng = np.random.default_rng(self._streams[i])
+        zvals, Uvals = self.zvals, self.Uvals
+        if self.resample:
+            idx = rng.integers(0, len(zvals), len(zvals))
+            idx = np.concatenate([[np.argmin(zvals), np.argmax(zvals)], idx])
+            zvals, Uvals = zvals[idx], Uvals[idx]
+        if self.noise > 0:
+            Uvals = Uvals + rng.normal(0, self.noise, len(Uvals))
+        return zvals, Uvals
+
+    def run(self, pmasses, temps_K, executor=None, batch_size=4,
+            settings=None, **kwargs):
+        """Return the rate constants and activation energies of the members.
+
+        Parameters
+        ----------
+        pmasses : list of floats
+            Particles' masses in daltons.
+
+        temps_K : array-like
+            Temperatures in kelvin.
+
+        executor : concurrent.futures.Executor, optional
+            Pool over which the batches of members are distributed.
+
+        batch_size : int, optional
+            Number of members of each batch.
+
+        settings : Settings instance, optional
+            Numerical settings of the members, as for `Calculator`; the
+            action integrals keep the tolerance derived for the first mass.
+
+        Other parameters
+        ----------------
+        Further keyword arguments are passed on to `Calculator`.
+
+        Return
+        ------
+        list with a dict for each mass, whose keys are `keys` and whose
+        values are ndarrays with shape (size, len(temps_K)); the rows of the
+        members that failed, e.g., as their barriers are no longer
+        symmetric barriers with a maximum at z = 0, are NaN, and a warning
+        names each of them and its error.
+        """
+        temps_K = np.asarray(temps_K, dtype=float)
+        if settings is not None:
+            kwargs = {**settings.get_kwargs(pmasses[0]), **kwargs}
+        # one engine per batch, whose quadrature rules serve all its members
+        kwargs.setdefault('engine', GaussAction())
+        batches = np.array_split(np.arange(self.size),
+                                 -(-self.size // batch_size))
+
+        fun = functools.partial(_run_batch, self, pmasses, temps_K, kwargs)
+        if executor is None or len(batches) == 1:
+            results = [fun(batch) for batch in batches]
+        else:
+            results = list(executor.map(fun, batches))
+        results = np.concatenate(results, axis=2)
+        return [dict(zip(self.keys, res)) for res in results]
+
+def _run_batch(ensemble, pmasses, temps_K, kwargs, members):
+    """Return the results of `members`; shape (masses, keys, members, temps)."""
+    results = np.full((len(pmasses), len(ensemble.keys), len(members),
+                       len(temps_K)), np.nan)
+    for j, i in enumerate(members):
+        try:
+            calc = Calculator(*ensemble.get_member(i), pmasses[0], **kwargs)
+            for n, pmass in enumerate(pmasses):
+                if n > 0:
+                    calc = calc.with_mass(pmass)
+                rates = calc.rates(temps_K)
+                arrh = calc.arrhenius(temps_K)
+                values = {**rates, **arrh}
+                results[n, :, j] = [values[key] for key in ensemble.keys]
+        except (AssertionError, ValueError, ArithmeticError) as err:
+            warnings.warn(f"Ensemble: member {i} failed"
+                          f" ({err.__class__.__name__}: {err}).")
+        else:
+            if np.isnan(results[:, :, j]).any():
+                warnings.warn(f"Ensemble: member {i} failed (NaN results).")
+    return results
+
+def get_bands(values, percentiles=(2.5, 50, 97.5)):
+    """Return the percentiles of `values` over the members.
+
+    Parameters
+    ----------
+    values : ndarray with shape (members, temperatures)
+        Results of the members; those that failed (NaN) are left out.
+
+    Return
+    ------
+    ndarray with shape (len(percentiles), temperatures)
+    """
+    with warnings.catch_warnings():
+        # temperatures at which all the members failed are NaN
+        warnings.simplefilter('ignore', RuntimeWarning)
+        return np.nanpercentile(values, percentiles, axis=0)
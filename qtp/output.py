@@ -0,0 +1,255 @@
+import json
+import os
+import sys
+
+import numpy as np
+
+def to_list(values):
+    """Return `values` as a (nested) list, with None for non-finite floats.
+
+    JSON has no representation of NaN and infinities; thus, they are
+    written as null.
+    """
+    values = np.asarray(values)
+    if values.dtype.kind == 'f':
+        values = np.where(np.isfinite(values), values, None)
+    return values.tolist()
+
+class Column(object):
+    """Column of a result table.
+
+    Parameters
+    ----------
+    key : str
+        Name of the column in machine-readable formats.
+
+    label : str
+        Heading of the column in text tables.
+
+    values : array-like
+        Values of the column.
+
+    width : int
+        Width of the column in text tables.
+
+    spec : str
+        Format specification of the values in text tables, e.g. '.6e'.
+    """
+
+    def __init__(self, key, label, values, width, spec):
+        self.key = key
+        self.label = label
+        self.values = np.asarray(values, dtype=float)
+        self.width = width
+        self.spec = spec
+
+
+class Table(object):
+    """Table of results, stored column-wise as NumPy arrays.
+
+    Parameters
+    ----------
+    name : str
+        Unique name of the table within the output.
+
+    columns : list of Column instances
+        Columns of the table; all must have the same length.
+
+    meta : dict, optional
+        Scalar values describing the whole table, e.g. the particle's mass.
+    """
+
+    def __init__(self, name, columns, meta=None):
+        assert len(set(len(c.values) for c in columns)) <= 1, \
+                f"Columns of table '{name}' have different lengths."
+        self.name = name
+        self.columns = columns
+        self.meta = dict(meta or {})
+
+    def __len__(self):
+        return len(self.columns[0].values) if self.columns else 0
+
+
+class Output(object):
+    """Writer of the program's messages and result tables.
+
+    Messages (titles, input summary, timestamps) are written as they come;
+    tables are rendered as a whole and written with a single call, or
+    streamed in chunks of rows with `write_chunks`.
+    The output is flushed after each table and when closed.
+
+    Parameters
+    ----------
+    path : str, optional
+        Output file; if None, the standard output is used.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stream = sys.stdout if path is None else open(path, 'w')
+        self.messages = self.stream
+
+    def log(self, *lines, end="\n"):
+        """Write message lines."""
+        self.messages.write("\n".join(lines) + end)
+
+    def write(self, table):
+        """Write a result table."""
+        raise NotImplementedError
+
+    def write_chunks(self, chunks):
+        """Write a result table given as consecutive chunks of rows.
+
+        Parameters
+        ----------
+        chunks : iterable of Table instances
+            Chunks of the table, with the same name, columns and metadata;
+            each one is written as it comes, so that long tables are
+            streamed without holding them in memory.
+        """
+        for table in chunks:
+            self.write(table)
+
+    def close(self):
+        """Flush the output and close the output file, if any."""
+        self.stream.flush()
+        if self.stream is not sys.stdout:
+            self.stream.close()
+        self.messages.flush()
+
+
+class TextOutput(Output):
+    """Human-readable text tables (default)."""
+
+    def write(self, table):
+        self.write_chunks([table])
+
+    def write_chunks(self, chunks):
+        sep = None
+        for table in chunks:
+            fmt = "  ".join(f"{{:>{c.width}{c.spec}}}" for c in table.columns)
+            rows = [fmt.format(*row)
+                    for row in zip(*(c.values.tolist() for c in table.columns))]
+            if sep is None:
+                head = "  ".join(f"{c.label:^{c.width}s}"
+                                 for c in table.columns)
+                sep = len(head)*"-"
+                rows = [sep, head, sep] + rows
+            if rows:
+                self.stream.write("\n".join(rows) + "\n")
+        if sep is not None:
+            self.stream.write(sep + "\n")
+        self.stream.flush()
+
+
+class CSVOutput(Output):
+    """Comma-separated values with full precision.
+
+    If an output file is given, each table is written to its own file,
+    named after the table (e.g. `out.rates.csv` for `-o out.csv`), and the
+    messages go to the standard output.
+    Otherwise, the tables are written one after the other to the standard
+    output, each preceded by a comment line with its name, and the messages
+    go to the standard error.
+    """
+
+    def __init__(self, path=None):
+        self.path = path
+        self.stream = sys.stdout
+        self.messages = sys.stdout if path is not None else sys.stderr
+
+    def write(self, table):
+        self.write_chunks([table])
+
+    def write_chunks(self, chunks):
+        stream = None
+        for table in chunks:
+            data = np.column_stack([np.full(len(table), float(v))
+                                    for v in table.meta.values()]
+                                   + [c.values for c in table.columns])
+            if stream is None:
+                if self.path is None:
+                    stream = self.stream
+                    stream.write(f"# {table.name}\n")
+                else:
+                    root, ext = os.path.splitext(self.path)
+                    stream = open(f"{root}.{table.name}{ext or '.csv'}", 'w')
+                stream.write(",".join(list(table.meta)
+                                      + [c.key for c in table.columns]) + "\n")
+            np.savetxt(stream, data, fmt='%.17g', delimiter=',')
+        if stream is None:
+            return
+        if self.path is None:
+            stream.write("\n")
+            stream.flush()
+        else:
+            stream.close()
+
+
+class JSONLinesOutput(Output):
+    """JSON lines: one object per table row, tagged with the table's name.
+
+    Non-finite values are written as null (see `to_list`).
+
+    The messages go to the standard error if the rows are written to the
+    standard output.
+    """
+
+    def __init__(self, path=None):
+        super().__init__(path)
+        self.messages = sys.stdout if path is not None else sys.stderr
+
+    def write(self, table):
+        keys = ["table"] + list(table.meta) + [c.key for c in table.columns]
+        fixed = [table.name] + [to_list(v) for v in table.meta.values()]
+        lines = [json.dumps(dict(zip(keys, fixed + list(row))), allow_nan=False)
+                 for row in zip(*(to_list(c.values) for c in table.columns))]
+        self.stream.write("\n".join(lines) + "\n")
+        self.stream.flush()
+
+
+class NPZOutput(Output):
+    """NumPy `.npz` archive written when the output is closed.
+
+    The array of column `key` of table `name` is stored as `name.key`, and
+    the table's metadata as `name.meta_key`.
+    As the archive is written at once, the chunks of a streamed table are
+    joined in memory.
+    """
+
+    def __init__(self, path=None):
+        assert path is not None, "The npz format requires an output file."
+        self.path = path
+        self.stream = sys.stdout
+        self.messages = sys.stdout
+        self.arrays = {}
+
+    def write(self, table):
+        for key, val in table.meta.items():
+            self.arrays[f"{table.name}.{key}"] = np.array(val)
+        for c in table.columns:
+            self.arrays[f"{table.name}.{c.key}"] = c.values
+
+    def write_chunks(self, chunks):
+        chunks = list(chunks)
+        if chunks:
+            self.write(Table(chunks[0].name, [
+                    Column(c.key, c.label,
+                           np.concatenate([t.columns[i].values for t in chunks]),
+                           c.width, c.spec)
+                    for i, c in enumerate(chunks[0].columns)], chunks[0].meta))
+
+    def close(self):
+        np.savez(self.path, **self.arrays)
+        super().close()
+
+
+formats = {'text': TextOutput,
+           'csv': CSVOutput,
+           'jsonl': JSONLinesOutput,
+           'npz': NPZOutput}
+
+def get_output(fmt='text', path=None):
+    """Return the writer for the output format `fmt`."""
+    assert fmt in formats, f"Unrecognized output format: '{fmt}'"
+    return formats[fmt](path)
@@ -0,0 +1,54 @@
+import concurrent.futures
+
+import numpy as np
+
+def get_executor(jobs):
+    """Return a process pool with `jobs` workers, or None for a serial run.
+
+    Parameters
+    ----------
+    jobs : int
+        Number of worker processes.
+    """
+    assert jobs >= 1, f"Invalid number of jobs: {jobs}"
+    if jobs == 1:
+        return None
+    return concurrent.futures.ProcessPoolExecutor(max_workers=jobs)
+
+def map_chunks(fun, vals, chunk_size, executor=None):
+    """Apply `fun` to consecutive chunks of `vals` and join the results.
+
+    The chunks are the same whether or not an executor is given, and the
+    results are joined in the order of `vals`, so that a parallel run
+    reproduces a serial one exactly.
+
+    Parameters
+    ----------
+    fun : callable
+        Function mapping a 1D array to a 1D array with the same length.
+        It must be picklable if `executor` is given.
+
+    vals : array-like
+        1D array of input values.
+
+    chunk_size : int
+        Number of values passed to each call of `fun`.
+
+    executor : concurrent.futures.Executor, optional
+        If None, the chunks are evaluated serially in this process.
+
+    Return
+    ------
+    ndarray with the results of `fun` for all `vals`.
+    """
+    vals = np.asarray(vals)
+    if len(vals) == 0:
+        return np.zeros(0)
+
+    nchunks = -(-len(vals) // chunk_size)
+    chunks = np.array_split(vals, nchunks)
+    if executor is None or nchunks == 1:
+        results = [fun(chunk) for chunk in chunks]
+    else:
+        results = list(executor.map(fun, chunks))
+    return np.concatenate(results)
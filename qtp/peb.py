@@ -1,17 +1,19 @@
+import bisect
+
 import numpy as np
-from scipy.interpolate import UnivariateSpline
-from scipy.optimize import minimize
+from scipy.interpolate import PPoly, UnivariateSpline
+
+from . import profiling
 
 class PEB(object):
     """Class for representing 1D potential energy barriers
     
     Parameters
     ----------
-    zvals : list
-        List of coordinates in bohr
-    Uvals : list
-        List of potential energies U(z) in hartree; must correspond to
-        `zvals`
+    zvals : array-like
+        Coordinates in bohr
+    Uvals : array-like
+        Potential energies U(z) in hartree; must correspond to `zvals`
 
     Notes
     -----
@@ -29,23 +31,69 @@ class PEB(object):
 
         def symmetrize_data(zvals, Uvals):
             _tiny = 1.0e-6
-            pts = [(abs(z), U) for z, U in zip(zvals, Uvals)]
-            right_pts = sorted(set(pts))
-            tmp_ = []
-            for x in set([z for z,u in right_pts]):
-                sel = [(z, u) for z, u in right_pts if abs(x-z) < _tiny]
-                zz, uu = zip(*sel)
-                tmp_.append((np.mean(zz), np.mean(uu)))
-            right_pts = tmp_
-            left_pts = [(-z, U) for z, U in right_pts if abs(z) > _tiny]
-            all_pts = sorted(left_pts + right_pts)
-            znew, Unew = zip(*all_pts)
-            Unew = list(np.array(Unew) - np.min(Unew))
-            return znew, Unew
-
-        self.zvals, self.Uvals = symmetrize_data(zvals, Uvals)
-        self.pebspl = UnivariateSpline(self.zvals, self.Uvals,
-                                       ext='zeros', k=3, s=0)
+            # fold onto z >= 0; repeated points count only once
+            pts = np.unique(np.column_stack([np.abs(zvals), Uvals]), axis=0)
+            # average the points whose |z| values differ by less than _tiny
+            starts = np.flatnonzero(np.diff(pts[:, 0], prepend=-np.inf)
+                                    >= _tiny)
+            counts = np.diff(np.append(starts, len(pts)))
+            zright = np.add.reduceat(pts[:, 0], starts) / counts
+            Uright = np.add.reduceat(pts[:, 1], starts) / counts
+            # mirror onto z < 0
+            left = zright > _tiny
+            znew = np.concatenate([-zright[left][::-1], zright])
+            Unew = np.concatenate([Uright[left][::-1], Uright])
+            return znew, Unew - np.min(Unew)
+
+        with profiling.timer('peb.symmetrize'):
+            self.zvals, self.Uvals = symmetrize_data(zvals, Uvals)
+        with profiling.timer('peb.spline'):
+            self.pebspl = UnivariateSpline(self.zvals, self.Uvals,
+                                           ext='zeros', k=3, s=0)
+            self.poly = PEBPoly(self.pebspl._eval_args)
+        profiling.count('peb.spline_constructions')
+        self._topology = None
+        self._branches = None
+
+    def __getstate__(self):
+        """Reduce the barrier to its data and spline knots/coefficients.
+
+        The cached topology and branch index are dropped; they are rebuilt
+        on demand, e.g., by the worker processes of a `-jobs` run.
+        """
+        return {'zvals': self.zvals,
+                'Uvals': self.Uvals,
+                'tck': self.pebspl._eval_args}
+
+    def __setstate__(self, state):
+        self.zvals = state['zvals']
+        self.Uvals = state['Uvals']
+        self.pebspl = UnivariateSpline._from_tck(state['tck'], ext=1)
+        self.poly = PEBPoly(state['tck'])
+        self._topology = None
+        self._branches = None
+
+    @property
+    def branches(self):
+        """Index of the monotone branches of U(z) (see `PEBBranches`).
+
+        The index is built on first access and cached afterwards.
+        """
+        if self._branches is None:
+            with profiling.timer('peb.branches'):
+                self._branches = PEBBranches(self)
+        return self._branches
+
+    @property
+    def topology(self):
+        """Critical points of the barrier (see `PEBTopology`).
+
+        The topology is analyzed on first access and cached afterwards.
+        """
+        if self._topology is None:
+            with profiling.timer('peb.topology'):
+                self._topology = PEBTopology(self)
+        return self._topology
 
     def __call__(self, z, der=0, ext=1):
         """Evaluate PEB or its derivatives at point z.
@@ -65,15 +113,17 @@ class PEB(object):
             defined in the knot sequence.
             0: extrapolate; 1: return zero; 2: raise ValueError;
             3: return boundary value.
+
+        Notes
+        -----
+        The spline is evaluated in its piecewise-polynomial form (see
+        `PEBPoly`), which is much cheaper than FITPACK for single points.
         """
-        return self.pebspl(z, nu=der, ext=ext)
+        return self.poly(z, der=der, ext=ext)
 
     def get_zfromUvalue(self, U):
         """Return the value(s) of z that give the requested U value."""
-        zvals = np.array(self.zvals)
-        uvals = np.array(self.Uvals) - U
-        spl = UnivariateSpline(zvals, uvals, ext='zeros', k=3, s=0)
-        return spl.roots()
+        return self.branches.get_zvalues(U)
 
     def get_Umax(self):
         """Find point of maximum in the potential energy barrier.
@@ -82,26 +132,361 @@ class PEB(object):
         ------
         (z, U(z)) tuple for the point of maximum U(z) value.
         """
+        return self.topology.z_Umax, self.topology.Umax
+
+
+class PEBPoly(object):
+    """Piecewise-polynomial form of the spline of a 1D potential barrier.
+
+    The spline is converted once into the coefficients of its polynomial
+    pieces in the local power basis, as in `scipy.interpolate.PPoly`, and
+    so are its derivatives.
+    Scalars are evaluated with a binary search over the break points and
+    Horner's rule on Python floats, which avoids the overhead of FITPACK and
+    of NumPy for single points; arrays are evaluated piece-wise with NumPy.
+
+    Parameters
+    ----------
+    tck : tuple
+        Knots, B-spline coefficients and degree of the spline.
+
+    Attributes
+    ----------
+    x : ndarray
+        Break points of the pieces; the spline is defined on [x[0], x[-1]].
+
+    coeffs : list of ndarrays
+        Coefficients of the pieces of U(z) and of its derivatives, with
+        shape (degree + 1 - der, number of pieces) and the highest power
+        first, as in `PPoly`; piece i is a polynomial of z - x[i].
+    """
+
+    def __init__(self, tck):
+        ppoly = PPoly.from_spline(tck, extrapolate=False)
+        # the repeated knots at the ends give empty pieces
+        keep = np.diff(ppoly.x) > 0
+        self.x = np.append(ppoly.x[:-1][keep], ppoly.x[1:][keep][-1])
+        c = ppoly.c[:, keep]
+        self.coeffs = []
+        while len(c):
+            self.coeffs.append(np.ascontiguousarray(c))
+            c = c[:-1] * np.arange(len(c) - 1, 0, -1)[:, None]
+        # the inner break points index the pieces, with the end pieces
+        # extended beyond the data range
+        self._inner = self.x[1:-1].copy()
+        # plain lists for `_evaluate_scalar`, by piece
+        self._x = self.x.tolist()
+        self._coeffs = [c.T.tolist() for c in self.coeffs]
+
+    def __call__(self, z, der=0, ext=1):
+        """Evaluate the spline or its derivatives at the point(s) z.
+
+        Parameters
+        ----------
+        z : float or array-like
+
+        der : int, optional
+            Order of the derivative.
+
+        ext : int, optional
+            Value returned for z out of [x[0], x[-1]], as in
+            `UnivariateSpline`: 0, extrapolate; 1, zero; 2, raise
+            ValueError; 3, the value at the boundary (as in FITPACK, the
+            derivatives are extrapolated).
+
+        Return
+        ------
+        float if z is a scalar (e.g., a Python int or float, or a 0-d
+        array), ndarray otherwise.
+        """
+        if not 0 <= der < len(self.coeffs):
+            raise ValueError(f"Invalid order of the derivative: {der}")
+        if isinstance(z, float):
+            return self._evaluate_scalar(z, der, ext)
+
+        z = np.asarray(z, dtype=float)
+        lo, hi = self._x[0], self._x[-1]
+        if ext != 0 and z.size and (z.min() < lo or z.max() > hi):
+            if ext == 2:
+                raise ValueError("z value is out of the range of the spline")
+            elif ext == 3 and der == 0:
+                z = np.clip(z, lo, hi)
+            outside = (z < lo) | (z > hi)
+        else:
+            ext = 0
+        i = self._inner.searchsorted(z, 'right')
+        t = z - self.x.take(i)
+        c = self.coeffs[der].take(i, axis=1)
+        U = c[0]
+        for cm in c[1:]:
+            U *= t
+            U += cm
+        if ext == 1:
+            U = np.where(outside, 0.0, U)[()]
+        return U
+
+    def _evaluate_scalar(self, z, der, ext):
+        """Evaluate a single point z without NumPy (see `__call__`)."""
+        x = self._x
+        if not x[0] <= z <= x[-1]:
+            if ext == 1:
+                return 0.0
+            elif ext == 2:
+                raise ValueError("z value is out of the range of the spline")
+            elif ext == 3 and der == 0:
+                z = min(max(z, x[0]), x[-1])
+        c = self._coeffs[der]
+        i = bisect.bisect_right(x, z, 1, len(x) - 1) - 1
+        t = z - x[i]
+        U = 0.0
+        for cm in c[i]:
+            U = U*t + cm
+        return U
+
+    def get_critical_points(self):
+        """Return the points z where dU/dz = 0, sorted.
+
+        The roots are solved exactly on each piece, as those of a quadratic
+        for cubic splines; thus, only degrees up to 3 are supported.
+        """
+        c = self.coeffs[1]
+        assert len(c) <= 3, "Only splines up to degree 3 are supported."
+        a, b, c0 = np.vstack([np.zeros((3 - len(c), c.shape[1])), c])
+        h = np.diff(self.x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            disc = b*b - 4*a*c0
+            # the stable form of the quadratic formula
+            q = -0.5*(b + np.copysign(np.sqrt(np.maximum(disc, 0)), b))
+            roots = np.column_stack([
+                    np.where(a != 0, q/a, np.where(b != 0, -c0/b, np.nan)),
+                    np.where(q != 0, c0/q, np.nan)])
+        roots[(a != 0) & (disc < 0)] = np.nan
+        roots[a == 0, 1] = np.nan
+        inside = (roots >= 0) & (roots <= h[:, None])
+        zvals = (self.x[:-1, None] + roots)[inside]
+        return np.unique(zvals)
+
+    def solve(self, Evals, zlo, zhi):
+        """Solve U(z) = E within brackets on which U(z) is monotone.
+
+        Each bracket [zlo, zhi] must lie within a single piece; the root is
+        found with a safeguarded Newton iteration on the polynomial of that
+        piece, and converged to machine precision.
+        """
+
+        _max_iter = 100
+        _eps = 4 * np.finfo(float).eps
+
+        zlo = np.array(zlo, dtype=float)
+        zhi = np.array(zhi, dtype=float)
+        i = np.clip(np.searchsorted(self.x, 0.5*(zlo + zhi), side='right') - 1,
+                    0, len(self.x) - 2)
+        c, dc, x0 = self.coeffs[0][:, i], self.coeffs[1][:, i], self.x[i]
+
+        def get_values(c, x0, z):
+            t = z - x0
+            U = c[0]
+            for cm in c[1:]:
+                U = U*t + cm
+            return U
+
+        flo = get_values(c, x0, zlo) - Evals
+        fhi = get_values(c, x0, zhi) - Evals
+        z = np.where(flo == 0, zlo, np.where(fhi == 0, zhi, 0.5*(zlo + zhi)))
+        todo = (flo != 0) & (fhi != 0)
+
+        for _ in range(_max_iter):
+            if not todo.any():
+                break
+            profiling.count('roots.newton_iterations')
+            z_ = z[todo]
+            f = get_values(c[:, todo], x0[todo], z_) - Evals[todo]
+            # shrink the bracket
+            left = np.sign(f) == np.sign(flo[todo])
+            zlo[todo] = np.where(left, z_, zlo[todo])
+            flo[todo] = np.where(left, f, flo[todo])
+            zhi[todo] = np.where(left, zhi[todo], z_)
+            # Newton step, or bisection if the step leaves the bracket
+            with np.errstate(divide='ignore', invalid='ignore'):
+                znew = z_ - f / get_values(dc[:, todo], x0[todo], z_)
+            outside = ~((znew >= zlo[todo]) & (znew <= zhi[todo]))
+            znew = np.where(outside, 0.5*(zlo[todo] + zhi[todo]), znew)
+            znew = np.where(f == 0, z_, znew)
+            z[todo] = znew
+            converged = (f == 0) \
+                | (np.abs(znew - z_) <= _eps * np.maximum(np.abs(znew), 1)) \
+                | (zhi[todo] - zlo[todo] <= _eps * np.maximum(np.abs(znew), 1))
+            todo[np.flatnonzero(todo)[converged]] = False
+
+        return z
+
+
+class PEBBranches(object):
+    """Index of the monotone branches of a 1D potential energy barrier.
+
+    The spline of the barrier is split at its critical points into branches
+    on which U(z) is monotone.
+    The values of z for which U(z) = E are then found on each branch by
+    a binary search over the branch's break points, followed by a
+    safeguarded Newton solve within a single polynomial piece.
+
+    Parameters
+    ----------
+    peb : PEB instance
+        The potential energy barrier to be indexed.
+
+    Attributes
+    ----------
+    zbreaks, Ubreaks : list of ndarrays
+        Break points of each branch and the corresponding values of U(z);
+        the values of U(z) are sorted in ascending order.
+    """
+
+    def __init__(self, peb):
+
+        self.poly = peb.poly
+
+        # break points of the polynomial pieces and critical points
+        zlo, zhi = peb.zvals[0], peb.zvals[-1]
+        crit_pts = self.poly.get_critical_points()
+        zpts = np.concatenate([self.poly.x, crit_pts])
+        zpts = np.unique(zpts[(zpts >= zlo) & (zpts <= zhi)])
+        Upts = self.poly(zpts)
+
+        # consecutive pieces with the same monotonicity form a branch
+        slopes = np.sign(np.diff(Upts))
+        starts = np.flatnonzero(np.diff(slopes) != 0) + 1
+        self.zbreaks = []
+        self.Ubreaks = []
+        for i0, i1 in zip(np.r_[0, starts], np.r_[starts, len(slopes)]):
+            if slopes[i0] == 0:
+                continue
+            z_ = zpts[i0:i1 + 1]
+            U_ = Upts[i0:i1 + 1]
+            if slopes[i0] < 0:
+                z_, U_ = z_[::-1], U_[::-1]
+            self.zbreaks.append(z_)
+            self.Ubreaks.append(U_)
+
+    def get_zvalues(self, U):
+        """Return the sorted values of z for which U(z) = U."""
+        _tiny = 1.0e-10
+
+        zvals = self.get_zmatrix([U])[0]
+        zvals = zvals[~np.isnan(zvals)]
+        return zvals[np.diff(zvals, prepend=-np.inf) > _tiny]
+
+    def get_zmatrix(self, Evals):
+        """Return the values of z for which U(z) = E on every branch.
+
+        Parameters
+        ----------
+        Evals : array-like
+            Values of U(z).
+
+        Return
+        ------
+        ndarray with shape (len(Evals), number of branches)
+            Column i holds the solutions on branch i, or NaN if the branch
+            does not reach E.
+            Since branches are ordered by z, each row is sorted.
+        """
+        Evals = np.ravel(np.asarray(Evals, dtype=float))
+        zmat = np.full((len(Evals), len(self.zbreaks)), np.nan)
+        profiling.count('roots.calls')
+        profiling.count('roots.energies', len(Evals))
+
+        rows, cols, zlo, zhi = [], [], [], []
+        for i, (z_, U_) in enumerate(zip(self.zbreaks, self.Ubreaks)):
+            sel = np.flatnonzero((Evals >= U_[0]) & (Evals <= U_[-1]))
+            j = np.clip(np.searchsorted(U_, Evals[sel]), 1, len(U_) - 1)
+            rows.append(sel)
+            cols.append(np.full(len(sel), i))
+            zlo.append(np.minimum(z_[j - 1], z_[j]))
+            zhi.append(np.maximum(z_[j - 1], z_[j]))
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        zmat[rows, cols] = self.poly.solve(Evals[rows], np.concatenate(zlo),
+                                           np.concatenate(zhi))
+        return zmat
+
+
+class PEBTopology(object):
+    """Critical points and type of a 1D potential energy barrier.
+
+    Parameters
+    ----------
+    peb : PEB instance
+        The potential energy barrier to be analyzed.
+
+    Attributes
+    ----------
+    critical_pts : ndarray
+        Values of z for which dU/dz = 0.
+    max_pts, min_pts : ndarray
+        Values of z for the local maxima and minima of U(z).
+    U0 : float
+        Potential energy at z=0.
+    z_Umax, Umax : float
+        Point of maximum in the potential energy barrier, with z <= 0, and
+        U(z_Umax).
+    peb_type : str
+        'type01' if the maximum is at z=0, 'type02' otherwise (i.e., two
+        symmetric maxima around a local minimum at z=0).
+    """
+
+    def __init__(self, peb):
 
         _small = 1.0e-4
+        _tiny = 1.0e-6
 
         # The `root()` method is only supported in order 3 splines; 
         # thus, we need to make sure that d1 is order 3.
-        spl = UnivariateSpline(self.zvals, self.Uvals, ext='zeros', k=4, s=0)
+        spl = UnivariateSpline(peb.zvals, peb.Uvals, ext='zeros', k=4, s=0)
         d1 = spl.derivative(n=1)
         d2 = spl.derivative(n=2)
+        profiling.count('peb.spline_constructions', 3)
 
         critical_pts = d1.roots()
         minmax_test = d2(critical_pts)
 
-        max_pts = [x for x, t in zip(critical_pts, minmax_test) if t < -1*_small]
-        max_vals = spl(max_pts)
+        self.critical_pts = critical_pts
+        self.max_pts = critical_pts[minmax_test < -1*_small]
+        self.min_pts = critical_pts[minmax_test > _small]
 
+        max_vals = spl(self.max_pts)
         max_idx = max_vals.argmax()
-        return max_pts[max_idx], max_vals[max_idx]
-
+        # the maxima of a symmetric barrier are equal up to rounding; the
+        # one with z <= 0 is taken, as assumed by `TransCoeff` and `PFlux`
+        self.z_Umax = -abs(self.max_pts[max_idx])
+        self.Umax = max_vals[max_idx]
 
-        
+        self.U0 = float(peb(0))
 
+        if abs(self.z_Umax) < _tiny:
+            self.peb_type = 'type01'
+        else:
+            self.peb_type = 'type02'
 
+    def to_arrays(self):
+        """Return the topology as a dict of arrays (see `from_arrays`)."""
+        return {'critical_pts': self.critical_pts,
+                'max_pts': self.max_pts,
+                'min_pts': self.min_pts,
+                'U0': np.array(self.U0),
+                'z_Umax': np.array(self.z_Umax),
+                'Umax': np.array(self.Umax),
+                'peb_type': np.array(self.peb_type)}
 
+    @classmethod
+    def from_arrays(cls, arrays):
+        """Rebuild a topology from the output of `to_arrays`."""
+        topo = cls.__new__(cls)
+        topo.critical_pts = np.asarray(arrays['critical_pts'])
+        topo.max_pts = np.asarray(arrays['max_pts'])
+        topo.min_pts = np.asarray(arrays['min_pts'])
+        topo.U0 = float(arrays['U0'])
+        topo.z_Umax = float(arrays['z_Umax'])
+        topo.Umax = float(arrays['Umax'])
+        topo.peb_type = str(arrays['peb_type'])
+        return topo
@@ -1,6 +1,17 @@
+import functools
+import warnings
+
 import numpy as np
 from scipy import integrate
 
+from . import profiling
+
+@functools.lru_cache(maxsize=None)
+def _get_rules(n):
+    """Return the Gauss-Laguerre and Gauss-Legendre rules of `n` nodes."""
+    return (np.polynomial.laguerre.laggauss(n),
+            np.polynomial.legendre.leggauss(n))
+
 class PFlux(object):
     """Particle flux (current) through a 1D potential energy barrier.
 
@@ -8,13 +19,52 @@ class PFlux(object):
     ----------
     traco : TransCoeff instance
         Calculator for the particle's transmission coefficient T(E).
+
+    table_tol : float or None, optional
+        Tolerance (absolute error in ln(T(E))) of the interpolation table
+        of T(E) used in the flux integral (see `TracoTable`).
+        The table is built once and shared by all temperatures.
+        If None, T(E) is calculated from scratch at every quadrature node.
+
+    flux_domain : {'z', 'energy'}, optional
+        Integration variable of the fluxes for many temperatures (see
+        `many` and `energy`).
+
+    flux_rtol : float, optional
+        Default relative tolerance of `many`.
+
+    energy_order : int, optional
+        Default order of the rules of `energy`.
+
+    Attributes
+    ----------
+    errors, rel_errors : ndarrays
+        Estimated absolute and relative errors of j_q from the last call to
+        `many` or `energy`.
+
+    max_panels : int
+        Largest number of panels of the z grid of `many`.
     """
 
-    def __init__(self, traco, **kwargs):
+    max_panels = 20000
+
+    def __init__(self, traco, table_tol=1.0e-6, flux_domain='z',
+                 flux_rtol=1.0e-8, energy_order=24, **kwargs):
+        assert flux_domain in ('z', 'energy'), \
+                f"Unknown flux domain: {flux_domain!r}"
+        assert flux_domain == 'z' or table_tol is not None, \
+                "The energy-domain fluxes need the table of T(E)."
         self.traco = traco
+        self.table_tol = table_tol
+        self.flux_domain = flux_domain
+        self.flux_rtol = flux_rtol
+        self.energy_order = energy_order
         self.peb = traco.peb
         self.pmass = traco.pmass
-        self.z_Umax, self.Umax = self.peb.get_Umax()
+        self.topology = self.peb.topology
+        self.z_Umax, self.Umax = self.topology.z_Umax, self.topology.Umax
+        self.errors = None
+        self.rel_errors = None
 
     def __call__(self, beta):
         """Calculate the classical and non-classical flux components.
@@ -45,21 +95,457 @@ class PFlux(object):
         j_c, j_q, j_c + j_q : tuple of floats
         """
         _zero = np.finfo(float).resolution # on a MacBook Pro 2017, this is ca. 1e-15
-        _tiny= 1e-6
 
-        def fun(x):
-            traco = self.traco(x)[1]
-            U = self.peb(x)
-            dU = self.peb(x, der=1)
-            return traco * np.exp(-beta * U) * dU
+        if self.table_tol is None:
+            def fun(x):
+                traco = self.traco(x)[1]
+                U = self.peb(x)
+                dU = self.peb(x, der=1)
+                return traco * np.exp(-beta * U) * dU
+        else:
+            table = self.traco.get_table(self.table_tol)
+
+            def fun(x):
+                U = self.peb(x)
+                dU = self.peb(x, der=1)
+                return np.exp(table(U) - beta * U) * dU
 
         zlims = self.peb.get_zfromUvalue(_zero)
         assert(zlims[0] < 0), "Problems finding integration limits."
         zlims = [zlims[0], self.z_Umax]
 
-        intgl = integrate.quad(fun, zlims[0], zlims[1])
+        intgl = integrate.quad(fun, zlims[0], zlims[1],
+                               full_output=profiling.enabled)
+        profiling.quad('flux.quad', intgl)
+        j_q = intgl[0]
+
+        # the rest of [0, Umax] where the spline peaks below Umax (see
+        # `get_grid`)
+        Etop = float(self.peb(self.z_Umax))
+        if Etop < self.Umax:
+            if self.table_tol is None:
+                ln_traco = lambda E: self.traco.batch_energy(np.array([E]))[0][0]
+            else:
+                ln_traco = self.traco.get_table(self.table_tol)
+            j_q += integrate.quad(lambda E: np.exp(ln_traco(E) - beta * E),
+                                  Etop, self.Umax)[0]
 
-        j_q = np.sqrt(beta/(2*np.pi * self.pmass)) * intgl[0]
+        j_q = np.sqrt(beta/(2*np.pi * self.pmass)) * j_q
         j_c = 1/np.sqrt(2*np.pi * self.pmass * beta) * np.exp(-beta * self.Umax)
 
-        return j_c, j_q, j_c + j_q
\ No newline at end of file
+        return j_c, j_q, j_c + j_q
+
+    def many(self, betas, rtol=None, moments=False, log=False):
+        """Calculate the flux components for many temperatures at once.
+
+        Only the factor exp(-beta*U(z)) of the integrand of j_q depends on
+        the temperature.
+        Thus, T(U(z)) dU/dz is evaluated once on a composite Gauss-Legendre
+        grid shared by all temperatures, and the integrals for all `betas`
+        are obtained from a single matrix product.
+        The grid panels are bisected until the estimated error of every
+        j_q is below `rtol` (relative).
+        The estimated errors of j_q are kept in the attributes `errors`
+        and `rel_errors`.
+        If the flux domain is 'energy', the calculation is passed on to
+        `energy` instead.
+
+        At low temperatures, T(E) and exp(-beta*E) span hundreds of orders
+        of magnitude, and the integrand is a narrow peak that may underflow.
+        Thus, the integrand of each temperature is scaled by its maximum,
+        exp(max(ln(T(E)) - beta*E)), located among the nodes of the table of
+        T(E), and the scale is added back to the logarithm of the integral.
+        Moreover, the z range is restricted to the energies at which the
+        integrand of any temperature is above exp(-40) times its maximum.
+
+        The activation energies, Eact = -d ln(k)/d(beta), follow from the
+        first energy moment of the same integrals.
+        With k = j * sqrt(2*pi*m*beta), k_c = exp(-beta*Umax) and
+        k_q = beta * int T(U) exp(-beta*U) dU/dz dz, one has
+
+        .. math::
+            E_{act,c} = U_{max}, \quad
+            E_{act,q} = \langle U \rangle_\beta - 1/\beta, \quad
+            E_{act,tot} = (k_c E_{act,c} + k_q E_{act,q}) / (k_c + k_q)
+
+        where the average is weighted by the integrand of j_q.
+
+        Parameters
+        ----------
+        betas : array-like
+            Inverse temperatures in atomic units.
+
+        rtol : float, optional
+            Relative tolerance for the integrals of j_q; `flux_rtol` by
+            default (see `get_grid`).
+
+        moments : bool, optional
+            If True, return the activation energies as well.
+
+        log : bool, optional
+            If True, return the natural logarithms of the fluxes, which do
+            not underflow.
+
+        Return
+        ------
+        j_c, j_q, j_c + j_q : tuple of ndarrays
+            If `moments` is True, the activation energies of the classical,
+            tunneling, and total rate constants follow.
+        """
+        if self.flux_domain == 'energy':
+            return self.energy(betas, moments=moments, log=log)
+        if rtol is None:
+            rtol = self.flux_rtol
+
+        betas = np.atleast_1d(np.asarray(betas, dtype=float))
+        grid_U, grid_ln_traco, grid_vec, peaks, done_err = \
+                self.get_grid(betas, rtol)
+        boltzmann = np.exp(grid_ln_traco - np.outer(betas, grid_U)
+                           - peaks[:, None])
+        intgl = boltzmann @ grid_vec
+
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean_U = (boltzmann @ (grid_U * grid_vec)) / intgl
+            return self._get_fluxes(betas, np.log(intgl) + peaks,
+                                    np.log(done_err) + peaks, mean_U,
+                                    moments, log)
+
+    def get_grid(self, betas, rtol):
+        """Return the z grid of `many` for the inverse temperatures `betas`.
+
+        The panels are bisected until the integrals of all `betas` meet
+        `rtol`, which is not taken tighter than the tolerance achieved by
+        the table of T(E); the bisection stops short of it, with a warning,
+        after 40 sweeps or when the grid would exceed `max_panels`.
+        Where the spline peaks below Umax, e.g., on coarse data, one panel
+        in E covers the rest of [0, Umax], as in the energy domain.
+
+        Return
+        ------
+        U, ln_traco, vec : ndarrays
+            U(z), ln(T(U(z))) and the weights times dU/dz at the nodes, so
+            that the integral of j_q is the sum of
+            exp(ln_traco - beta*U - peak) * vec, times exp(peak).
+
+        peaks : ndarray
+            Scale of the integrand of each beta (see `many`).
+
+        errors : ndarray
+            Estimated error of each integral, scaled as the integrand.
+        """
+        _zero = np.finfo(float).resolution # on a MacBook Pro 2017, this is ca. 1e-15
+        _n0 = 8         # initial panels between consecutive break points
+        _max_iter = 40
+
+        betas = np.atleast_1d(np.asarray(betas, dtype=float))
+
+        zlims = self.peb.get_zfromUvalue(_zero)
+        assert(zlims[0] < 0), "Problems finding integration limits."
+        zlims = [zlims[0], self.z_Umax]
+
+        def get_zvalue(U):
+            """Return z between the integration limits for which U(z) = U."""
+            return [z for z in self.peb.get_zfromUvalue(U)
+                    if zlims[0] < z < zlims[1]]
+
+        zpts = list(zlims)
+        peaks = None
+        if self.table_tol is not None:
+            # the interpolated T(E) is no more accurate than the table
+            rtol = max(rtol, self.traco.get_table(self.table_tol).tol)
+            peaks, Elo, Ehi = self._get_window(betas)
+            if Elo > _zero:
+                zpts[0] = (get_zvalue(Elo) or zpts[:1])[0]
+            if Ehi < self.Umax:
+                zpts[1] = (get_zvalue(Ehi) or zpts[1:])[0]
+        # T(E) is discontinuous at the energies of `TransCoeff.get_jumps`,
+        # e.g., at E = U0 for 'type02' barriers
+        for E in self.traco.get_jumps()[0]:
+            zpts += [z for z in get_zvalue(E) if zpts[0] < z < zpts[1]]
+        zpts = np.unique(zpts)
+        a = np.concatenate([np.linspace(z0, z1, _n0 + 1)[:-1]
+                            for z0, z1 in zip(zpts[:-1], zpts[1:])])
+        b = np.append(a[1:], zpts[-1])
+        length = zpts[-1] - zpts[0]
+
+        x, w = np.polynomial.legendre.leggauss(10)
+
+        def get_nodes(a, b):
+            """Return U(z), ln(T(U(z))) and w*dU/dz at the nodes of the panels."""
+            z = 0.5*(a + b)[:, None] + 0.5*(b - a)[:, None] * x
+            U = self.peb(z)
+            dU = self.peb(z, der=1)
+            if self.table_tol is None:
+                ln_traco = self.traco.batch(z)[0]
+            else:
+                ln_traco = self.traco.get_table(self.table_tol)(U)
+            return U, ln_traco, 0.5*(b - a)[:, None] * w * dU
+
+        def get_panel_intgls(U, ln_traco, vec):
+            """Return the panel integrals for all betas; shape (nbetas, npanels)."""
+            return np.einsum('bpn,pn->bp', np.exp(
+                    ln_traco - betas[:, None, None] * U - peaks[:, None, None]),
+                    vec)
+
+        # accepted grid nodes
+        grid_U, grid_ln_traco, grid_vec = [], [], []
+        done_intgl = np.zeros_like(betas)
+        done_err = np.zeros_like(betas)
+
+        U, ln_traco, vec = get_nodes(a, b)
+        if peaks is None:
+            peaks = np.max(ln_traco.ravel() - np.outer(betas, U.ravel()), axis=1)
+        coarse = get_panel_intgls(U, ln_traco, vec)
+        npanels = 0     # accepted panels of the grid
+        for _ in range(_max_iter):
+            m = 0.5*(a + b)
+            U, ln_traco, vec = get_nodes(np.concatenate([a, m]),
+                                         np.concatenate([m, b]))
+            fine = get_panel_intgls(U, ln_traco, vec)
+            left, right = np.split(fine, 2, axis=1)
+            err = np.abs(left + right - coarse)
+            total = np.abs(done_intgl + (left + right).sum(axis=1))
+            bad = (err > rtol * total[:, None] * (b - a) / length).any(axis=0)
+
+            good = np.concatenate([~bad, ~bad])
+            grid_U.append(U[good])
+            grid_ln_traco.append(ln_traco[good])
+            grid_vec.append(vec[good])
+            done_intgl += (left + right)[:, ~bad].sum(axis=1)
+            done_err += err[:, ~bad].sum(axis=1)
+            npanels += good.sum()
+            profiling.count('flux.refinements')
+
+            if not bad.any():
+                break
+            # the next sweep evaluates the halves of the bisected panels
+            if npanels + 4*bad.sum() > self.max_panels:
+                warnings.warn("PFlux.many: maximum number of panels reached"
+                              f" before achieving rtol={rtol}.")
+                break
+            a, b = np.concatenate([a[bad], m[bad]]), np.concatenate([m[bad], b[bad]])
+            coarse = np.concatenate([left[:, bad], right[:, bad]], axis=1)
+        else:
+            warnings.warn("PFlux.many: maximum number of refinements reached"
+                          f" before achieving rtol={rtol}.")
+        if bad.any():
+            grid_U.append(U[np.concatenate([bad, bad])])
+            grid_ln_traco.append(ln_traco[np.concatenate([bad, bad])])
+            grid_vec.append(vec[np.concatenate([bad, bad])])
+            done_err += err[:, bad].sum(axis=1)
+
+        # on coarse data, the spline may peak below Umax, which the z grid
+        # does not reach; the rest of [0, Umax] is integrated over E
+        Etop = float(self.peb(zpts[-1]))
+        if zpts[-1] == self.z_Umax and Etop < self.Umax:
+            U = 0.5*(self.Umax + Etop) + 0.5*(self.Umax - Etop) * x
+            if self.table_tol is None:
+                ln_traco = self.traco.batch_energy(U)[0]
+            else:
+                ln_traco = self.traco.get_table(self.table_tol)(U)
+            grid_U.append(U[None])
+            grid_ln_traco.append(ln_traco[None])
+            grid_vec.append(0.5*(self.Umax - Etop) * w[None])
+
+        grid_U = np.concatenate(grid_U).ravel()
+        profiling.count('flux.nodes', len(grid_U))
+        return (grid_U, np.concatenate(grid_ln_traco).ravel(),
+                np.concatenate(grid_vec).ravel(), peaks, done_err)
+
+    def _get_window(self, betas):
+        """Return the maxima of ln(T(E)) - beta*E and the energy window.
+
+        The maxima are located among the nodes of the table of T(E); the
+        window holds the energies at which ln(T(E)) - beta*E is above its
+        maximum minus 40 for any of the `betas`.
+
+        Return
+        ------
+        peaks : ndarray
+            Maximum for each beta.
+
+        Elo, Ehi : floats
+            Limits of the window.
+        """
+        _cutoff = 40.0  # ln of the relative size of negligible contributions
+
+        table = self.traco.get_table(self.table_tol)
+        E = np.concatenate([table._get_energy(i, s)
+                            for i, s in enumerate(table.nodes)])
+        order = np.argsort(E)
+        E = E[order]
+        phi = np.concatenate(table.vals)[order] - np.outer(betas, E)
+        peaks = phi.max(axis=1)
+
+        # the window is widened by a node on each side
+        inside = np.flatnonzero((phi >= peaks[:, None] - _cutoff).any(axis=0))
+        Elo = E[max(inside[0] - 1, 0)]
+        Ehi = E[min(inside[-1] + 1, len(E) - 1)]
+        return peaks, Elo, Ehi
+
+    def _get_fluxes(self, betas, ln_intgl, ln_err, mean_E, moments, log):
+        """Return the fluxes (and activation energies) from the integrals.
+
+        `ln_intgl` and `ln_err` are the logarithms of the integral of
+        T(E) exp(-beta*E) over E and of its estimated error, and `mean_E` is
+        the mean energy of its integrand; see `many` for the arguments
+        `moments` and `log`.
+        """
+        ln_factor = 0.5*np.log(betas/(2*np.pi * self.pmass))
+        ln_j_q = ln_factor + ln_intgl
+        ln_j_c = -betas * self.Umax - 0.5*np.log(2*np.pi * self.pmass * betas)
+        ln_j_tot = np.logaddexp(ln_j_c, ln_j_q)
+        self.errors = np.exp(ln_factor + ln_err)
+        self.rel_errors = np.exp(ln_err - ln_intgl)
+
+        fluxes = (ln_j_c, ln_j_q, ln_j_tot)
+        if not log:
+            fluxes = tuple(np.exp(f) for f in fluxes)
+        if not moments:
+            return fluxes
+
+        eact_q = mean_E - 1/betas
+        eact_c = np.full_like(betas, self.Umax)
+        eact_tot = np.exp(ln_j_c - ln_j_tot) * eact_c \
+                 + np.exp(ln_j_q - ln_j_tot) * eact_q
+
+        return fluxes + (eact_c, eact_q, eact_tot)
+
+    def energy(self, betas, order=None, moments=False, log=False):
+        """Calculate the flux components in the energy domain.
+
+        As T(U(z)) depends on z only through U, the integral of j_q is
+
+        .. math::
+            j_q(\\beta) = \\sqrt{\\frac{\\beta}{2 \\pi m}}
+            \\int_0^{U_{max}} T(E) \\exp(-\\beta E) dE
+
+        while the rest of the integral over all energies, where T(E) = 1,
+        is the classical flux j_c in closed form.
+        For each temperature and each segment of the table of T(E) (see
+        `TracoTable`), the maximum of the integrand is located among the
+        table nodes, and each side of the maximum is integrated with a rule
+        of `order` nodes: if the integrand decays by more than exp(-20)
+        before the end of the side, Gauss-Laguerre nodes scaled to its decay
+        rate are used, otherwise Gauss-Legendre nodes in the table's
+        coordinate s, which is smooth at E = 0 unlike E itself.
+        Laguerre nodes beyond the end of the side are dropped.
+        Thus, at most 4*`order` (8*`order` for 'type02' barriers) values of
+        the interpolated T(E) are needed per temperature; the estimated
+        errors, kept in the attributes `errors` and `rel_errors`, are the
+        differences from the rules of `order`/2 nodes, times a safety
+        factor: across the kinks of the table, these differences do not
+        decrease steadily with the order, and underestimated the errors by
+        up to a factor of ca. 2 on the barriers of `benchmark`.
+        As in `many`, the integrals are accumulated in log space, so that
+        they do not underflow.
+
+        With the default order, j_q agrees with the z-domain integral of
+        `many` within a relative error of 1e-5 (a few 1e-6 on typical
+        barriers), from cryogenic temperatures to well above the crossover
+        temperature; the activation energies agree within 1e-6 hartree.
+
+        Parameters
+        ----------
+        betas : array-like
+            Inverse temperatures in atomic units.
+
+        order : int, optional
+            Number of nodes of the rule on each side of the maximum;
+            `energy_order` by default.
+
+        moments, log : bool, optional
+            If True, return the activation energies as well, and the
+            logarithms of the fluxes, respectively (see `many`).
+
+        Return
+        ------
+        j_c, j_q, j_c + j_q : tuple of ndarrays
+            If `moments` is True, the activation energies of the classical,
+            tunneling, and total rate constants follow.
+        """
+        _safety = 4.0   # factor of the error estimates (see above)
+
+        if order is None:
+            order = self.energy_order
+        betas = np.atleast_1d(np.asarray(betas, dtype=float))
+        table = self.traco.get_table(self.table_tol)
+
+        # logarithms of the integrals, accumulated with log-sum-exp
+        ln_intgl = np.zeros_like(betas)
+        ln_err = np.zeros_like(betas)
+        mean_E = np.zeros_like(betas)
+        for ib, beta in enumerate(betas):
+            for n in (order, order//2):
+                E, ln_w = map(np.concatenate, zip(*[
+                        self._get_energy_nodes(table, i, beta, n)
+                        for i in range(len(table.bounds))]))
+                ln_terms = ln_w + table(E) - beta*E
+                if n == order:
+                    peak = ln_terms.max()
+                    terms = np.exp(ln_terms - peak)
+                    intgl = terms.sum()
+                    ln_intgl[ib] = peak + np.log(intgl)
+                    mean_E[ib] = (terms @ E) / intgl
+                    profiling.count('flux.energy_nodes', len(E))
+                else:
+                    with np.errstate(divide='ignore'):
+                        ln_err[ib] = peak + np.log(_safety*abs(
+                                intgl - np.exp(ln_terms - peak).sum()))
+
+        return self._get_fluxes(betas, ln_intgl, ln_err, mean_E, moments, log)
+
+    @staticmethod
+    def _get_energy_nodes(table, i, beta, n):
+        """Return the nodes of `energy` for segment `i` of the table.
+
+        Return
+        ------
+        E, ln_w : ndarrays
+            Energies and logarithms of the weights, such that the integral
+            of T(E) exp(-beta E) over the segment is approximated by
+            sum(exp(ln_w + ln(T(E)) - beta E)).
+        """
+        _cutoff = 20.0  # decay of ln(integrand) that makes a side decaying
+        _decay = 10.0   # decay of ln(integrand) fitting the Laguerre rate
+
+        lo, hi = table.bounds[i]
+        s = table.nodes[i]
+        E = table._get_energy(i, s)
+        # ln of the integrand in E and in s (dE = 2 (hi - lo) s ds)
+        phi = table.vals[i] - beta*E
+        with np.errstate(divide='ignore'):
+            psi = phi + np.log(2*(hi - lo)*s)
+        k = np.argmax(psi)
+
+        E_nodes, ln_w = [], []
+        for end in (0.0, 1.0):
+            if s[k] == end:
+                continue
+            side = (s >= s[k]) if end else (s <= s[k])
+            # towards E = 0, the decay is measured in E; towards Umax, in s
+            x = np.abs(E[side] - E[k]) if end == 0 else np.abs(s[side] - s[k])
+            drop = (phi[k] - phi[side]) if end == 0 else (psi[k] - psi[side])
+            idx = np.argsort(x)
+            x, drop = x[idx], drop[idx]
+
+            if drop[-1] > _cutoff:
+                xl, wl = _get_rules(n)[0]
+                rate = _decay / x[np.argmax(drop > _decay)]
+                t = xl[xl < rate*x[-1]] / rate
+                lw = np.log(wl[:len(t)]) + rate*t - np.log(rate)
+                if end == 0:
+                    E_nodes.append(E[k] - t)
+                    ln_w.append(lw)
+                else:
+                    si = s[k] + t
+                    E_nodes.append(table._get_energy(i, si))
+                    ln_w.append(lw + np.log(2*(hi - lo)*si))
+            else:
+                xg, wg = _get_rules(n)[1]
+                a, b = sorted([s[k], end])
+                si = 0.5*(a + b) + 0.5*(b - a)*xg
+                E_nodes.append(table._get_energy(i, si))
+                ln_w.append(np.log(0.5*(b - a)*wg*2*(hi - lo)*si))
+
+        return np.concatenate(E_nodes), np.concatenate(ln_w)
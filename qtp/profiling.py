@@ -0,0 +1,117 @@
+"""Lightweight instrumentation of the hot paths of the program.
+
+The instrumentation is disabled by default; until `enable()` is called,
+the functions below return immediately and `timer()` returns a shared
+no-op context manager.
+Instrumented code that needs extra work to collect its data checks the
+module-level flag `enabled` first.
+"""
+import contextlib
+import json
+import time
+
+enabled = False
+
+counters = {}   # name -> accumulated value
+timers = {}     # name -> [number of calls, total wall-clock time in s]
+records = {}    # name -> list of dicts (e.g., one per temperature)
+
+_null = contextlib.nullcontext()
+
+def enable():
+    """Enable the instrumentation and clear the collected data."""
+    global enabled
+    enabled = True
+    counters.clear()
+    timers.clear()
+    records.clear()
+
+def count(name, value=1):
+    """Add `value` to the counter `name`."""
+    if enabled:
+        counters[name] = counters.get(name, 0) + value
+
+def maximum(name, value):
+    """Keep the largest `value` reported for `name` as a counter."""
+    if enabled:
+        counters[name] = max(counters.get(name, value), value)
+
+def record(name, **values):
+    """Append a row of values to the record `name`."""
+    if enabled:
+        records.setdefault(name, []).append(values)
+
+class _Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+
+    def __exit__(self, *exc):
+        t = timers.setdefault(self.name, [0, 0.0])
+        t[0] += 1
+        t[1] += time.perf_counter() - self.start
+
+def timer(name):
+    """Return a context manager accumulating wall-clock time for `name`."""
+    return _Timer(name) if enabled else _null
+
+def quad(name, output):
+    """Account for the full output of `scipy.integrate.quad`.
+
+    The number of integrand evaluations and subintervals, as well as the
+    largest error estimate, are accumulated under `name`.
+    """
+    if enabled:
+        count(f"{name}.calls")
+        count(f"{name}.integrand_evals", output[2]['neval'])
+        count(f"{name}.subintervals", output[2]['last'])
+        maximum(f"{name}.max_error", output[1])
+
+def quad_vec(name, output, nintegrals):
+    """Account for the full output of `scipy.integrate.quad_vec`."""
+    if enabled:
+        count(f"{name}.calls")
+        count(f"{name}.integrals", nintegrals)
+        count(f"{name}.integrand_evals", output[2].neval)
+        count(f"{name}.subintervals", len(output[2].intervals))
+        maximum(f"{name}.max_error", output[1])
+
+def get_report():
+    """Return the collected data as a JSON-serializable dict."""
+    return {'timers': {k: {'calls': n, 'seconds': t}
+                       for k, (n, t) in timers.items()},
+            'counters': dict(counters),
+            'records': records}
+
+def format_report(report):
+    """Return a text summary of `report` (see `get_report`)."""
+    lines = ["Profile", 7*"="]
+
+    lines += ["", f"{'Timer':<32s}  {'calls':>8s}  {'seconds':>12s}"]
+    for name, t in sorted(report['timers'].items()):
+        lines.append(f"{name:<32s}  {t['calls']:>8d}  {t['seconds']:>12.6f}")
+
+    lines += ["", f"{'Counter':<32s}  {'value':>22s}"]
+    for name, value in sorted(report['counters'].items()):
+        if isinstance(value, float):
+            lines.append(f"{name:<32s}  {value:>22.6e}")
+        else:
+            lines.append(f"{name:<32s}  {value:>22d}")
+
+    for name, rows in sorted(report['records'].items()):
+        keys = list(rows[0])
+        lines += ["", name, "  ".join(f"{k:>14s}" for k in keys)]
+        for row in rows:
+            lines.append("  ".join(f"{row[k]:>14.6e}"
+                                   if isinstance(row[k], float)
+                                   else f"{row[k]:>14}" for k in keys))
+    return "\n".join(lines)
+
+def write_report(path):
+    """Write the collected data as JSON to `path`."""
+    with open(path, 'w') as fp:
+        json.dump(get_report(), fp, indent=1, sort_keys=True)
+        fp.write("\n")
@@ -1,33 +1,23 @@
-import os
 import sys
 
 import datetime
 
 import numpy as np
 
-import warnings
-
-from scipy import constants
-
-sys.path.insert(0, os.path.dirname(__file__))
-from cmdline import parser
-from peb import PEB
-from traco import TransCoeff
-from pflux import PFlux
-from arrhenius import Arrhenius
-sys.path.pop(0)
-
-dalton2me = constants.atomic_mass/constants.m_e
-kelvin2au = 1 / (constants.value('Hartree energy')/constants.k)
-angst2bohr = constants.angstrom/constants.value('Bohr radius')
+from .cmdline import get_temps, parse_args
+from .output import Column, Table, get_output
+from . import profiling
 
 def main():
 
+    args = parse_args()
+    out = get_output(args.format, args.output)
+    if args.profile is not None:
+        profiling.enable()
+
     title = "Quantum Transport Properties v.3 (QTP3)"
-    print(len(title) * "=")
-    print(title)
-    print(len(title) * "=")
-    print("Timestamp:", datetime.datetime.now(), end=2*"\n", flush=True)
+    out.log(len(title) * "=", title, len(title) * "=")
+    out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
 
 
     #-------------------- 
@@ -35,196 +25,232 @@ def main():
     #-------------------- 
     # N.B., suffixes are used to indicate values _not_ in atomic units.
 
-    args = parser.parse_args()
+    out.log("N.B. Unspecified units imply atomic units (hartree, bohr, etc.)", 
+            end=2*"\n")
 
-    print("N.B. Unspecified units imply atomic units (hartree, bohr, etc.)", 
-          end=2*"\n", flush=True)
+    pmasses_Da = args.pmass  # particles' masses in daltons
 
-    pmass_Da = args.pmass  # particle's mass in daltons
-    pmass = pmass_Da * dalton2me    # particles mass in electron mass
+    temps_K = get_temps(args.temp)  # temperatures in kelvin
+
+    assert args.ensemble is None or args.noise > 0 or args.resample, \
+            "An ensemble needs `-noise` or `-resample`."
+
+    # the numerical modules are only imported once the arguments are valid,
+    # which keeps `-h` and input errors quick
+    from .calculator import Calculator
+    from .parallel import get_executor
+    from .settings import Settings
+
+    if args.preset is not None:
+        settings = Settings.preset(args.preset)
+    else:
+        settings = None
 
-    print(f"Particle's mass (Da):  {pmass_Da}",
-          f"Particle's mass (m_e): {pmass}",
-          sep="\n", end=2*"\n", flush=True)
+    executor = get_executor(args.jobs)
 
-    # temperatures in kelvin
-    if len(args.temp) == 1:
-        temps_K = args.temp
-    elif len(args.temp) == 3:
-        temps_K = list(np.arange(*args.temp))
+    if args.cache is not None:
+        from .cache import Cache
+        cache = Cache(args.cache, max_size=int(args.cachesize * 2**20))
     else:
-        raise AssertionError(f"Invalid temperature input:"
-                             f" {' '.join(args.temp)}")
+        cache = None
+
+    # ln k (classic, tunnel, total) of each isotope, for the isotope effects
+    ln_ks = []
+
+    calc = None
+    for n, pmass_Da in enumerate(pmasses_Da):
+
+        # tables of an isotope series are distinguished by a suffix
+        if len(pmasses_Da) > 1:
+            label = f"Isotope {n+1} of {len(pmasses_Da)}"
+            out.log(len(label)*"=", label, len(label)*"=", end=2*"\n")
+            suffix = f"_{n+1}"
+        else:
+            suffix = ""
+
+        # the barrier and the WKB action integrals are shared by all isotopes
+        if calc is None:
+            calc = Calculator.from_file(args.datafile, pmass_Da,
+                                        executor=executor, cache=cache,
+                                        settings=settings,
+                                        flux_domain=args.flux_domain)
+        else:
+            calc = calc.with_mass(pmass_Da)
+
+        out.log(f"Particle's mass (Da):  {pmass_Da}",
+                f"Particle's mass (m_e): {calc.traco.pmass}", end=2*"\n")
+
+        # the same temperatures are used for all isotopes
+        if n == 0 and args.temptol is not None:
+            temps_K = list(calc.refine_temps(temps_K, args.temptol,
+                                             args.maxtemps))
+            out.log(f"Adaptive temperature grid: {len(temps_K)} temperatures"
+                    f" (tolerance of ln k: {args.temptol})", end=2*"\n")
+
+        rates = write_properties(out, args, temps_K, calc, suffix,
+                                 {'pmass_Da': pmass_Da})
+        ln_ks.append(np.array([rates['ln_k_classic'], rates['ln_k_tunnel'],
+                               rates['ln_k_total']]))
+        calc.save()
 
-    # z and U(z) values
-    with open(args.datafile, 'r') as fp:
-        values = [float(v) for s in fp.readlines()
-                    if len(s.strip()) > 0 and s.strip()[0] != '#'
-                    for v in s.strip().split()]
+    #------------------------------
+    # Ensemble of perturbed barriers
+    #------------------------------
 
-    zvals_angst = values[0::2]   # values of z in angstrom
-    zvals = [z*angst2bohr for z in zvals_angst]
+    if args.ensemble is not None:
+        write_ensemble(out, args, temps_K, settings, executor)
 
-    Uvals = values[1::2]   # values of U(z) in hartree
+    # no more transmission coefficients are needed
+    if executor is not None:
+        executor.shutdown()
+
+    #------------------------------
+    # Calculate isotope effects
+    #------------------------------
 
-    # instantiate PEB, TransCoeff, and PFlux
-    peb = PEB(zvals, Uvals)
-    traco = TransCoeff(peb, pmass)
-    pflux = PFlux(traco)
+    for n, pmass_Da in enumerate(pmasses_Da[1:], start=1):
+        out.log("Kinetic isotope effects:"
+                f" k({pmasses_Da[0]} Da) / k({pmass_Da} Da)")
+
+        # isotope effects beyond the range of floats are printed as inf
+        with np.errstate(over='ignore'):
+            kies = np.exp(ln_ks[0] - ln_ks[n])
+        out.write(Table(f"kie_{n+1}", [
+            Column("temp_K", "Temp/K", temps_K, 10, ".2f"),
+            Column("inv_temp_K", "beta/(1/K)", 1/np.array(temps_K), 10, ".2e"),
+            Column("beta", "beta/a.u.", rates['beta'], 10, ".2f"),
+            Column("kie_classic", "KIE (classic)", kies[0], 14, ".6e"),
+            Column("kie_tunnel", "KIE (tunnel)", kies[1], 14, ".6e"),
+            Column("kie_total", "KIE (total)", kies[2], 14, ".6e"),
+            ], {'pmass_Da': pmasses_Da[0], 'pmass2_Da': pmass_Da}))
+        out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
+
+    out.close()
+
+    if args.profile == '-':
+        print(profiling.format_report(profiling.get_report()), file=sys.stderr)
+    elif args.profile is not None:
+        profiling.write_report(args.profile)
+
+
+def write_properties(out, args, temps_K, calc, suffix="", meta=None):
+    """Write the local properties, rate constants and activation energies.
+
+    The tables are named 'local', 'rates' and 'arrhenius', followed by
+    `suffix`; `meta` is attached to all of them.
+    The local properties are given at the data points or, with `-zrange`,
+    on its grid, which is evaluated and written in chunks (see
+    `Calculator.iter_local`).
+
+    Return
+    ------
+    dict of ndarrays with the rate constants (see `Calculator.rates`).
+    """
 
     #-------------------- 
     # Print U(z) data
     #-------------------- 
 
-    # Define coordinates for which data should be printed in the output
     if args.zrange_angst is not None:
-        zcoords = list(np.arange(*args.zrange_angst)*angst2bohr)
-        print("Info for z/angstrom from {x[0]:} to {x[1]:} (step={x[2]:})"\
-                  .format(x=args.zrange_angst), flush=True)
+        out.log("Info for z/angstrom from {x[0]:} to {x[1]:} (step={x[2]:})"\
+                    .format(x=args.zrange_angst))
+    else:
+        out.log(f"Info for all points in `{args.datafile}`")
+
+    if args.zrange_angst is not None:
+        chunks = calc.iter_local(args.zrange_angst)
     else:
-        zcoords = zvals
-        print(f"Info for all points in `{args.datafile}`", flush=True)
-
-    head = "  ".join(
-        [
-            '{:^12s}'.format("z/angstrom"),
-            '{:^12s}'.format("z/bohr"),
-            '{:^12s}'.format("U(z)/hartree"),
-            '{:^12s}'.format("dU/dz"),
-            '{:^12s}'.format("T(U(z))"),
-            '{:^12s}'.format("ln T(U(z))"),
-        ]
-    )
-    print(len(head)*"-", flush=True)
-    print(head, flush=True)
-    print(len(head)*"-", flush=True)
-
-    # zlist = [zvals[0] - (zvals[1]-zvals[0])]
-    # zlist += zvals
-    # zlist += [zvals[-1] + (zvals[-1]-zvals[-2])]
-    # for z in zlist:
-    for z in zcoords:
-        ln_T, T = traco(z)
-        row = "  ".join(
-            [
-                '{:>12.6f}'.format(z/angst2bohr),
-                '{:>12.6f}'.format(z),
-                '{:>12.6f}'.format(peb(z)),
-                '{:>12.6f}'.format(peb(z, der=1)),
-                '{:>12.6e}'.format(T),
-                '{:>12.6f}'.format(ln_T),
-            ]
-        )
-        print(row, flush=True)
-
-    print(len(head)*"-", flush=True)
-    print("Timestamp:", datetime.datetime.now(), end=2*"\n", flush=True)
+        chunks = [calc.local()]
+    out.write_chunks(Table("local" + suffix, [
+        Column("z_angstrom", "z/angstrom", local['z_angstrom'], 12, ".6f"),
+        Column("z_bohr", "z/bohr", local['z_bohr'], 12, ".6f"),
+        Column("U", "U(z)/hartree", local['U'], 12, ".6f"),
+        Column("dU_dz", "dU/dz", local['dU_dz'], 12, ".6f"),
+        Column("T", "T(U(z))", local['T'], 12, ".6e"),
+        Column("ln_T", "ln T(U(z))", local['ln_T'], 12, ".6f"),
+        ], meta) for local in chunks)
+    out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
 
     #----------------------------
     # Calculate properties of 1/T
     #----------------------------
 
-    head = "  ".join(
-        [
-            '{:^10s}'.format("Temp/K"),
-            '{:^10s}'.format("beta/(1/K)"),
-            '{:^10s}'.format("beta/a.u."),
-            '{:^14s}'.format("k (classic)"),
-            '{:^14s}'.format("k (tunnel)"),
-            '{:^14s}'.format("k (total)"),
-            '{:^14s}'.format("flux (classic)"),
-            '{:^14s}'.format("flux (tunnel)"),
-            '{:^14s}'.format("flux (total)"),
-        ]
-    )
-    print(len(head)*"-", flush=True)
-    print(head, flush=True)
-    print(len(head)*"-", flush=True)
-
-    # these four lists will be used by the arrhenius module
-    betas = []
-    ln_kcs = []
-    ln_kqs = []
-    ln_ktots = []
-
-    for t in temps_K:
-        beta = 1/(t*kelvin2au)
-        j_c, j_q, j_tot = pflux(beta)
-        j2k = np.sqrt(2*np.pi*pmass*beta)
-        k_c = j_c * j2k
-        k_q = j_q * j2k
-        k_tot = j_tot * j2k
-        row = "  ".join(
-            [
-                '{:>10.2f}'.format(t),
-                '{:>10.2e}'.format(1/t),
-                '{:>10.2f}'.format(beta),
-                '{:>14.6e}'.format(k_c),
-                '{:>14.6e}'.format(k_q),
-                '{:>14.6e}'.format(k_tot),
-                '{:>14.6e}'.format(j_c),
-                '{:>14.6e}'.format(j_q),
-                '{:>14.6e}'.format(j_tot),
-            ]
-        )
-        print(row, flush=True)
-        betas.append(beta)
-        ln_kcs.append(np.log(k_c))
-        ln_kqs.append(np.log(k_q))
-        ln_ktots.append(np.log(k_tot))
-    print(len(head)*"-", flush=True)
-    print("Timestamp:", datetime.datetime.now(), end=2*"\n", flush=True)
+    rates = calc.rates(temps_K)
+    out.write(Table("rates" + suffix, [
+        Column("temp_K", "Temp/K", rates['temp_K'], 10, ".2f"),
+        Column("inv_temp_K", "beta/(1/K)", rates['inv_temp_K'], 10, ".2e"),
+        Column("beta", "beta/a.u.", rates['beta'], 10, ".2f"),
+        Column("k_classic", "k (classic)", rates['k_classic'], 14, ".6e"),
+        Column("k_tunnel", "k (tunnel)", rates['k_tunnel'], 14, ".6e"),
+        Column("k_total", "k (total)", rates['k_total'], 14, ".6e"),
+        Column("flux_classic", "flux (classic)", rates['flux_classic'], 14, ".6e"),
+        Column("flux_tunnel", "flux (tunnel)", rates['flux_tunnel'], 14, ".6e"),
+        Column("flux_total", "flux (total)", rates['flux_total'], 14, ".6e"),
+        Column("k_rel_error", "k rel. error", rates['k_rel_error'], 12, ".1e"),
+        ], meta))
+    out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
 
     #------------------------------
     # Calculate activation energies
     #------------------------------
 
-    if len(temps_K) < 4:
-        warnings.warn("Skipping activation energies."
-                      "Less than 04 data points available.")
-        sys.exit()
-
-    arrhenius_c = Arrhenius(betas, ln_kcs)
-    arrhenius_q = Arrhenius(betas, ln_kqs) 
-    arrhenius_tot = Arrhenius(betas, ln_ktots)
-
-    head = "  ".join(
-        [
-            '{:^10s}'.format('Temp/K'),
-            '{:^10s}'.format('beta/(1/K)'),
-            '{:^10s}'.format('beta/a.u.'),
-            '{:^15s}'.format('Eact (classic)'),
-            '{:^15s}'.format('Eact (tunnel)'),
-            '{:^15s}'.format('Eact (total)'),
-            '{:^15s}'.format('Coeff (classic)'),
-            '{:^15s}'.format('Coeff (tunnel)'),
-            '{:^15s}'.format('Coeff (total)'),
-        ]
-    )
-    print(len(head)*"-", flush=True)
-    print(head, flush=True)
-    print(len(head)*"-", flush=True)
-        
-    for t, beta in zip(temps_K, betas):
-        eact_c, coeff_c = arrhenius_c(beta)
-        eact_q, coeff_q = arrhenius_q(beta)
-        eact_tot, coeff_tot = arrhenius_tot(beta)
-        row = "  ".join(
-            [
-                '{:>10.2f}'.format(t),
-                '{:>10.2e}'.format(1/t),
-                '{:>10.2f}'.format(beta),
-                '{:>15.8f}'.format(eact_c),
-                '{:>15.8f}'.format(eact_q),
-                '{:>15.8f}'.format(eact_tot),
-                '{:>15.6e}'.format(coeff_c),
-                '{:>15.6e}'.format(coeff_q),
-                '{:>15.6e}'.format(coeff_tot),
-            ]
-        )
-        print(row, flush=True)
-    print(len(head)*"-", flush=True)
-    print("Timestamp:", datetime.datetime.now(), end=2*"\n", flush=True)
+    arrh = calc.arrhenius(temps_K)
+    out.write(Table("arrhenius" + suffix, [
+        Column("temp_K", "Temp/K", arrh['temp_K'], 10, ".2f"),
+        Column("inv_temp_K", "beta/(1/K)", arrh['inv_temp_K'], 10, ".2e"),
+        Column("beta", "beta/a.u.", arrh['beta'], 10, ".2f"),
+        Column("Eact_classic", "Eact (classic)", arrh['Eact_classic'], 15, ".8f"),
+        Column("Eact_tunnel", "Eact (tunnel)", arrh['Eact_tunnel'], 15, ".8f"),
+        Column("Eact_total", "Eact (total)", arrh['Eact_total'], 15, ".8f"),
+        Column("coeff_classic", "Coeff (classic)", arrh['coeff_classic'], 15, ".6e"),
+        Column("coeff_tunnel", "Coeff (tunnel)", arrh['coeff_tunnel'], 15, ".6e"),
+        Column("coeff_total", "Coeff (total)", arrh['coeff_total'], 15, ".6e"),
+        ], meta))
+    out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
+
+    return rates
+
+
+def write_ensemble(out, args, temps_K, settings=None, executor=None):
+    """Write the percentile bands of an ensemble of perturbed barriers.
+
+    The tables are named 'ensemble', followed by the suffix of the isotope
+    as in `main`.
+    """
+    from .datafile import load_data
+    from .ensemble import Ensemble, get_bands
+
+    ensemble = Ensemble(*load_data(args.datafile), args.ensemble,
+                        noise=args.noise, resample=args.resample,
+                        seed=args.seed)
+    out.log(f"Ensemble of {ensemble.size} barriers (noise/hartree:"
+            f" {args.noise}, resampled: {args.resample}, seed: {args.seed})",
+            end=2*"\n")
+    results = ensemble.run(args.pmass, temps_K, executor=executor,
+                           settings=settings, flux_domain=args.flux_domain)
+
+    for n, (pmass_Da, res) in enumerate(zip(args.pmass, results)):
+        suffix = f"_{n+1}" if len(args.pmass) > 1 else ""
+        failed = int(np.isnan(res['ln_k_total']).any(axis=1).sum())
+        out.log(f"Percentiles over the ensemble for {pmass_Da} Da"
+                f" ({failed} of {ensemble.size} members failed)")
+        columns = [Column("temp_K", "Temp/K", temps_K, 10, ".2f")]
+        for key, label in [('k_tunnel', "k (tunnel)"),
+                           ('k_total', "k (total)")]:
+            bands = np.exp(get_bands(res['ln_' + key], args.percentiles))
+            columns += [Column(f"{key}_p{p:g}", f"{label} {p:g}%", b, 16,
+                               ".6e")
+                        for p, b in zip(args.percentiles, bands)]
+        for key, label in [('Eact_tunnel', "Eact (tunnel)"),
+                           ('Eact_total', "Eact (total)")]:
+            bands = get_bands(res[key], args.percentiles)
+            columns += [Column(f"{key}_p{p:g}", f"{label} {p:g}%", b, 16,
+                               ".8f")
+                        for p, b in zip(args.percentiles, bands)]
+        out.write(Table("ensemble" + suffix, columns,
+                        {'pmass_Da': pmass_Da, 'members': ensemble.size,
+                         'failed': failed}))
+        out.log(f"Timestamp: {datetime.datetime.now()}", end=2*"\n")
 
 
 if __name__ == '__main__':
@@ -0,0 +1,194 @@
+"""Sensitivities of the rate constants to the points of the barrier.
+
+The barrier's spline is linear in its coefficients, U(z) = sum_b c_b B_b(z),
+where B_b(z) are the B-splines, and the coefficients are linear in the
+(symmetrized) data points.
+A change dU(z) of the barrier changes
+
+* the action integrals, A(E) = int sqrt(U(z) - E) dz, by
+  dA(E) = int dU(z) / (2 sqrt(U(z) - E)) dz over the same intervals, as the
+  integrand of A(E) vanishes at the turning points; thus,
+  d ln(T(E)) = -2 sqrt(2m) dA(E);
+* the tunneling flux, j_q ~ int_0^Umax T(E) exp(-beta E) dE, by the integral
+  of T(E) exp(-beta E) d ln(T(E)), and by the integrand at the limits of the
+  integral that move with the barrier: Umax, and the energies at which T(E)
+  is discontinuous (see `TransCoeff.get_jumps`), e.g., U0 for 'type02'
+  barriers;
+* the classical flux, j_c ~ exp(-beta Umax), by -beta dUmax.
+
+Umax is taken from the quartic spline of `PEBTopology`, as are the fluxes.
+
+The integrals over the energy are evaluated on the z grid of `PFlux.many`,
+whose nodes resolve the variation of d ln(T(E)) near the top of the barrier
+on the scale of the spline knots; the derivatives for all the data points
+cost about as much as one evaluation of the rate constants.
+"""
+import numpy as np
+
+from scipy import sparse
+from scipy.interpolate import BSpline, UnivariateSpline
+
+from .action import GaussAction
+from . import profiling
+
+def get_basis(peb, z):
+    """Return the B-splines of the barrier's spline at the points `z`.
+
+    Return
+    ------
+    sparse matrix with shape (len(z), number of coefficients)
+    """
+    t, c, k = peb.pebspl._eval_args
+    z = np.clip(z, t[k], t[-k-1])
+    return BSpline.design_matrix(z, t, k)
+
+def get_action_derivatives(traco, Evals, order=8):
+    """Return the derivatives of the action integrals for the energies `Evals`.
+
+    The integrals of B_b(z) / (2 sqrt(U(z) - E)) are evaluated as in
+    `GaussAction`, with `order` nodes per piece between the spline knots; the
+    cosine map of the pieces cancels the inverse square root at the turning
+    points.
+
+    Return
+    ------
+    ndarray with shape (len(Evals), number of coefficients), with the
+    derivatives dA(E)/dc_b.
+    """
+    peb = traco.peb
+    intervals, z0, z1 = traco.get_intervals(Evals)
+    rows, p0, p1 = GaussAction._get_pieces(peb.pebspl.get_knots(), z0, z1)
+    rows = intervals[rows]
+
+    x, w = np.polynomial.legendre.leggauss(order)
+    theta = 0.5*np.pi * (x + 1)
+    x = 0.5*(1 - np.cos(theta))
+    w = 0.25*np.pi * w * np.sin(theta)
+
+    dz = (p1 - p0)[:, None]
+    z = p0[:, None] + dz*x
+    with np.errstate(divide='ignore'):
+        weights = dz*w / (2*np.sqrt(np.maximum(peb(z) - Evals[rows][:, None],
+                                               0)))
+    weights[~np.isfinite(weights)] = 0
+    profiling.count('sensitivity.integrand_evals', z.size)
+
+    nodes = sparse.csr_matrix(
+            (weights.ravel(), (np.repeat(rows, order), np.arange(z.size))),
+            shape=(len(Evals), z.size))
+    return (nodes @ get_basis(peb, z.ravel())).toarray()
+
+def get_sensitivities(pflux, betas, order=8):
+    """Return the derivatives of ln(j) with respect to the barrier's points.
+
+    Parameters
+    ----------
+    pflux : PFlux instance
+        Fluxes of the particle; the integrals over the energy are evaluated
+        on the z grid of `PFlux.many`.
+
+    betas : array-like
+        Inverse temperatures in atomic units.
+
+    order : int, optional
+        Number of nodes per piece of the derivatives of the action integrals.
+
+    Return
+    ------
+    dln_j_c, dln_j_q : ndarrays with shape (len(betas), len(peb.zvals))
+        Derivatives of the logarithms of the classical and tunneling fluxes
+        with respect to the symmetrized data points, `peb.Uvals`.
+    """
+    betas = np.atleast_1d(np.asarray(betas, dtype=float))
+    traco = pflux.traco
+    peb = traco.peb
+    topo = peb.topology
+
+    # the nodes of the z grid of the fluxes, U(z) = E, share the derivatives
+    # of the action integrals among all temperatures
+    Evals, ln_traco, vec, peaks, _ = pflux.get_grid(betas, pflux.flux_rtol)
+    # the action integrals vanish at the top of the barrier
+    inside = Evals < topo.Umax
+    dln_traco = np.zeros((len(Evals), len(peb.pebspl.get_coeffs())))
+    dln_traco[inside] = -2*np.sqrt(2*traco.pmass) \
+            * get_action_derivatives(traco, Evals[inside], order)
+
+    terms = np.exp(ln_traco - np.outer(betas, Evals) - peaks[:, None]) * vec
+    intgl = terms.sum(axis=1)
+    dln_j_q = (terms @ dln_traco) / intgl[:, None]
+
+    # the moving limits: the energies at which T(E) jumps, the values of the
+    # spline at its lowest points (e.g., U0 = U(0) for 'type02' barriers),
+    # and Umax, which is found on the quartic spline of `PEBTopology`
+    for E, z in zip(*traco.get_jumps()):
+        ln_traco_E = traco.batch_energy(
+                np.array([np.nextafter(E, -np.inf), E]))[0]
+        jump = np.exp(ln_traco_E[1] - betas*E - peaks) \
+             - np.exp(ln_traco_E[0] - betas*E - peaks)
+        dE = get_basis(peb, np.array([z, -z])).toarray().mean(axis=0)
+        dln_j_q -= np.outer(jump / intgl, dE)
+
+    # from the spline coefficients to the data points, through the
+    # interpolation conditions U(z_j) = sum_b c_b B_b(z_j)
+    colloc = get_basis(peb, peb.zvals).toarray()
+    dln_j_q = np.linalg.solve(colloc.T, dln_j_q.T).T
+
+    dUmax = get_top_derivatives(peb)
+    ln_traco_top = traco.batch_energy(np.array([topo.Umax]))[0]
+    top = np.exp(ln_traco_top - betas*topo.Umax - peaks) / intgl
+    return -np.outer(betas, dUmax), dln_j_q + np.outer(top, dUmax)
+
+def get_top_derivatives(peb):
+    """Return the derivatives of Umax with respect to `peb.Uvals`.
+
+    As U(z) is stationary at its maxima, they are the values of the
+    cardinal functions of the quartic spline at the maxima; both maxima of
+    'type02' barriers move together for symmetric changes of the barrier.
+    """
+    topo = peb.topology
+    t, c, k = UnivariateSpline(peb.zvals, peb.Uvals, k=4, s=0)._eval_args
+    colloc = BSpline.design_matrix(peb.zvals, t, k).toarray()
+    basis = BSpline.design_matrix(np.array([topo.z_Umax, -topo.z_Umax]),
+                                  t, k).toarray()
+    return np.linalg.solve(colloc.T, basis.mean(axis=0))
+
+def get_data_sensitivities(peb, zvals, sens):
+    """Return the sensitivities with respect to the input data points.
+
+    The symmetrization of `PEB` averages the points with the same |z|,
+    mirrors them, and shifts the barrier by its lowest point; the
+    sensitivities `sens` with respect to `peb.Uvals` are mapped back
+    through these steps.
+    Where several points share the lowest energy, ln k is not
+    differentiable with respect to them; the shift is then attributed to
+    the first one.
+
+    Parameters
+    ----------
+    zvals : array-like
+        Coordinates in bohr of the input data points.
+
+    sens : ndarray with shape (..., len(peb.zvals))
+
+    Return
+    ------
+    ndarray with shape (..., len(zvals))
+    """
+    sens = np.array(sens, dtype=float)
+    # the shift by the lowest point
+    sens[..., np.argmin(peb.Uvals)] -= sens.sum(axis=-1)
+
+    # each input point counts as much as the others of its group
+    zright = peb.zvals[peb.zvals >= 0]
+    sym_group = np.searchsorted(zright, np.abs(peb.zvals))
+    right = np.abs(np.asarray(zvals, dtype=float))
+    idx = np.clip(np.searchsorted(zright, right), 1, len(zright) - 1)
+    group = np.where(right - zright[idx - 1] < zright[idx] - right,
+                     idx - 1, idx)
+    if len(zright) == 1:
+        group = np.zeros(len(right), dtype=int)
+    counts = np.bincount(group, minlength=len(zright))
+
+    by_group = np.zeros(sens.shape[:-1] + (len(zright),))
+    np.add.at(by_group.T, sym_group, sens.T)
+    return by_group[..., group] / counts[group]
@@ -0,0 +1,306 @@
+"""Persistent server answering JSON-lines requests.
+
+Usage: python -m qtp.server [-socket <path>] [-workers <n>]
+
+Each request is a JSON object on a single line, e.g.::
+
+    {"id": 1, "method": "rates", "datafile": "potential.dat", "pmass": 1,
+     "temps_K": [300]}
+
+with the members:
+
+* `method`: 'local', 'rates' or 'arrhenius' (see `Calculator`), or 'ping';
+* `datafile`: path of the potential energy barrier's data file, or
+  `barrier`: the barrier itself, as a list of [z, U(z)] pairs;
+* `pmass`: particle's mass in daltons (default: 1);
+* `z`: distances in angstroms, for 'local' (default: the data points);
+* `temps_K`: temperatures in kelvin, for 'rates' and 'arrhenius';
+* `id`: any value, which is copied into the response.
+
+Each response is a JSON object on a single line, holding the `id` and either
+`result`, a dict of lists, or `error`, a message.
+Non-finite values of the results, e.g., rate constants that underflow in
+log space, are written as null.
+Responses are written as soon as they are ready, which is not necessarily
+in the order of the requests.
+
+Requests are read from the standard input, or from the connections to a
+Unix socket, and are dispatched to a pool of worker processes.
+All requests for the same barrier go to the same worker, which keeps the
+calculators of the most recently used barriers and masses in memory.
+Their results are written to the on-disk cache, if any, when they are
+evicted and when the server shuts down; the action integrals of 'local'
+requests are not kept, so that the memory of a calculator stays bounded.
+"""
+import argparse
+import asyncio
+import collections
+import concurrent.futures
+import hashlib
+import json
+import os
+import signal
+import sys
+import zlib
+
+import numpy as np
+
+from .calculator import Calculator
+from .output import to_list
+
+methods = ('local', 'rates', 'arrhenius')
+
+# per worker process: (barrier key, mass) -> Calculator, least recent first
+_calculators = collections.OrderedDict()
+_options = {'maxsize': 32, 'cache': None}
+
+def _init_worker(maxsize, cache_path, cache_size):
+    # interrupts are handled by the server process
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    _options['maxsize'] = maxsize
+    if cache_path is not None:
+        from .cache import Cache
+        _options['cache'] = Cache(cache_path, max_size=cache_size)
+
+def get_route(request):
+    """Return the name identifying the barrier of `request`."""
+    if 'datafile' in request:
+        return os.path.realpath(request['datafile'])
+    barrier = json.dumps(request.get('barrier'), separators=(',', ':'))
+    return hashlib.sha256(barrier.encode()).hexdigest()
+
+def _get_calculator(request):
+    """Return the (possibly cached) calculator for `request`."""
+    route = get_route(request)
+    if 'datafile' in request:
+        # an edited file is a different barrier
+        stat = os.stat(route)
+        bkey = (route, stat.st_mtime_ns, stat.st_size)
+    else:
+        bkey = (route,)
+    pmass = float(request.get('pmass', 1))
+
+    calc = _calculators.get((bkey, pmass))
+    if calc is not None:
+        _calculators.move_to_end((bkey, pmass))
+        return calc
+
+    # another mass of the same barrier shares its action integrals
+    other = next((c for (k, _), c in _calculators.items() if k == bkey), None)
+    if other is not None:
+        calc = other.with_mass(pmass)
+    elif 'datafile' in request:
+        calc = Calculator.from_file(route, pmass, cache=_options['cache'])
+    else:
+        data = np.array(request['barrier'], dtype=float, ndmin=2)
+        assert data.ndim == 2 and data.shape[1] == 2, \
+                "Invalid barrier: a list of [z, U(z)] pairs is expected."
+        calc = Calculator(data[:, 0], data[:, 1], pmass,
+                          cache=_options['cache'])
+
+    _calculators[(bkey, pmass)] = calc
+    while len(_calculators) > _options['maxsize']:
+        _calculators.popitem(last=False)[1].save()
+    return calc
+
+def _save_calculators():
+    """Save the results of the calculators of the worker into the cache."""
+    for calc in _calculators.values():
+        calc.save()
+
+def handle(request):
+    """Answer a request in the worker process.
+
+    Return
+    ------
+    dict with the response, except for its `id`.
+    """
+    try:
+        method = request.get('method')
+        if method == 'ping':
+            return {'result': {'pid': os.getpid(),
+                               'calculators': len(_calculators)}}
+        assert method in methods, f"Unknown method: {method!r}"
+        assert ('datafile' in request) != ('barrier' in request), \
+                "Either `datafile` or `barrier` must be given."
+
+        calc = _get_calculator(request)
+        if method == 'local':
+            result = calc.local(request.get('z'), store=False)
+        else:
+            assert 'temps_K' in request, "Missing `temps_K`."
+            result = getattr(calc, method)(request['temps_K'])
+        return {'result': {k: to_list(v) for k, v in result.items()}}
+
+    except Exception as err:
+        return {'error': f"{err.__class__.__name__}: {err}"}
+
+
+def _dumps(response):
+    """Return the JSON line of `response`, which must be valid JSON."""
+    try:
+        return json.dumps(response, allow_nan=False)
+    except ValueError as err:
+        return json.dumps({'id': None, 'error': f"Invalid response: {err}"})
+
+
+class Server(object):
+    """Dispatcher of JSON-lines requests to a pool of worker processes.
+
+    Parameters
+    ----------
+    workers : int, optional
+        Number of worker processes.
+
+    maxsize : int, optional
+        Number of calculators kept in memory by each worker.
+
+    cache : str, optional
+        Directory of the on-disk cache of results (see `Cache`).
+
+    cachesize : int, optional
+        Size limit in bytes of the on-disk cache.
+    """
+
+    def __init__(self, workers=1, maxsize=32, cache=None, cachesize=512*2**20):
+        # one single-process pool per worker, so that each barrier is
+        # always handled by the same process
+        self.workers = [
+            concurrent.futures.ProcessPoolExecutor(
+                max_workers=1, initializer=_init_worker,
+                initargs=(maxsize, cache, cachesize))
+            for _ in range(workers)]
+        # start the processes now: forked later, while a thread is blocked
+        # reading the standard input, they would deadlock closing it
+        for worker in self.workers:
+            worker.submit(os.getpid).result()
+
+    def save(self):
+        """Save the results of the workers' calculators into the cache."""
+        for worker in self.workers:
+            try:
+                worker.submit(_save_calculators).result()
+            except concurrent.futures.BrokenExecutor:
+                pass
+
+    def shutdown(self):
+        self.save()
+        for worker in self.workers:
+            worker.shutdown()
+
+    async def answer(self, line):
+        """Return the response line to the request `line`."""
+        try:
+            request = json.loads(line)
+            assert isinstance(request, dict), "A JSON object is expected."
+        except (ValueError, AssertionError) as err:
+            return _dumps({'id': None, 'error': f"Invalid request: {err}"})
+
+        try:
+            route = get_route(request)
+        except (TypeError, ValueError) as err:
+            response = {'error': f"{err.__class__.__name__}: {err}"}
+        else:
+            worker = self.workers[zlib.crc32(route.encode()) % len(self.workers)]
+            loop = asyncio.get_running_loop()
+            response = await loop.run_in_executor(worker, handle, request)
+        return _dumps({'id': request.get('id'), **response})
+
+    async def serve_lines(self, readline, write):
+        """Answer the lines returned by the coroutine `readline` until EOF.
+
+        The requests are answered concurrently; `write` is called with each
+        response line.
+        """
+        pending = set()
+
+        async def reply(line):
+            write(await self.answer(line) + "\n")
+
+        while True:
+            line = await readline()
+            if not line:
+                break
+            if line.strip():
+                task = asyncio.create_task(reply(line))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+        if pending:
+            await asyncio.wait(pending)
+
+    async def serve_stdio(self):
+        """Answer the requests read from the standard input."""
+        loop = asyncio.get_running_loop()
+
+        async def readline():
+            return await loop.run_in_executor(None, sys.stdin.readline)
+
+        def write(text):
+            sys.stdout.write(text)
+            sys.stdout.flush()
+
+        await self.serve_lines(readline, write)
+
+    async def serve_socket(self, path):
+        """Answer the requests of the connections to the Unix socket `path`."""
+
+        async def connection(reader, writer):
+
+            async def readline():
+                return (await reader.readline()).decode()
+
+            await self.serve_lines(readline,
+                                   lambda text: writer.write(text.encode()))
+            await writer.drain()
+            writer.close()
+
+        server = await asyncio.start_unix_server(connection, path)
+        async with server:
+            await server.serve_forever()
+
+
+def main():
+    parser = argparse.ArgumentParser(
+            prog="qtp.server",
+            description="Answer JSON-lines requests for QTP calculations,"
+                        " keeping the barriers in memory between requests.")
+    parser.add_argument('-socket', dest='socket', metavar="<path>",
+                        default=None,
+                        help="Unix socket to listen on."
+                             " (Default: standard input and output)")
+    parser.add_argument('-workers', dest='workers', metavar="<number>",
+                        type=int, default=1,
+                        help="number of worker processes. (Default: 1)")
+    parser.add_argument('-maxsize', dest='maxsize', metavar="<number>",
+                        type=int, default=32,
+                        help="calculators kept in memory per worker."
+                             " (Default: 32)")
+    parser.add_argument('-cache', dest='cache', metavar="<dir>",
+                        default=os.environ.get('QTP_CACHE'),
+                        help="directory of the on-disk cache."
+                             " (Default: $QTP_CACHE, if set)")
+    parser.add_argument('-cachesize', dest='cachesize', metavar="<MB>",
+                        type=float, default=512,
+                        help="size limit of the on-disk cache in MB."
+                             " (Default: 512)")
+    args = parser.parse_args()
+
+    server = Server(args.workers, args.maxsize, args.cache,
+                    int(args.cachesize * 2**20))
+    # terminate cleanly, as with Ctrl-C
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    try:
+        if args.socket is None:
+            asyncio.run(server.serve_stdio())
+        else:
+            asyncio.run(server.serve_socket(args.socket))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if args.socket is not None and os.path.exists(args.socket):
+            os.unlink(args.socket)
+        server.shutdown()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""Numerical settings from a target relative error of the rate constants.
+
+The error of k comes from the nested integrals:
+
+* the WKB action integrals, A(E), on which ln(T(E)) = -2 sqrt(2m) A(E)
+  depends (see `action`);
+* the interpolation table of ln(T(E)) (see `TracoTable`);
+* the flux integral over the temperature (see `PFlux`);
+* the turning points, U(z) = E, found on the barrier's spline; these are
+  converged to machine precision at a negligible cost, and the action
+  integrand vanishes at them, so they take no share of the budget.
+
+An absolute error of ln(T(E)) is a relative error of T(E), and thus of k.
+Hence, the target relative error of k is split into an absolute error of
+ln(T(E)) for the table, one for the action integrals (converted to an error
+of A(E) with the particle's mass), and a relative error for the flux
+integral; as the flux integral is not converged beyond the accuracy of the
+table (see `PFlux.get_grid`), it gets the same share as the table.
+
+The estimated errors of k (see `Calculator.rates`) are those of the
+numerical integrals for the barrier's spline, not those of the spline
+itself, which depend on the density of the data points.
+"""
+import numpy as np
+
+from .action import AdaptiveAction, GaussAction
+from .units import dalton2me
+
+class Settings(object):
+    """Numerical settings for a target relative error of k.
+
+    Parameters
+    ----------
+    rtol : float, optional
+        Target relative error of the rate constants.
+
+    energy_order : int, optional
+        Number of nodes of the energy-domain flux rules (see `PFlux.energy`).
+        Their accuracy is limited to ca. 1e-7 by the kinks of the table of
+        T(E) at its panel ends; tighter targets need the z domain.
+
+    action_order : int, optional
+        Number of nodes of the fixed-order rule of the action integrals
+        (see `GaussAction`).
+        The integrals whose error estimate exceeds their tolerance are
+        passed on to the adaptive fallback, whose results depend slightly
+        on the other integrals of the same batch; for tight targets, this
+        noise keeps the table of T(E) from converging, and a higher order
+        avoids the fallback.
+
+    Attributes
+    ----------
+    presets : dict
+        Target, energy order and action order of the named presets; for
+        protium, the tolerance of the table of 'default' is close to the
+        program's fixed one.
+
+    shares : dict
+        Fractions of the target assigned to the table of T(E), the action
+        integrals and the flux integral.
+    """
+
+    presets = {'fast': (1.0e-3, 12, 16),
+               'default': (2.0e-6, 24, 16),
+               'tight': (1.0e-8, 48, 64)}
+
+    shares = {'table': 0.4, 'action': 0.2, 'flux': 0.4}
+
+    def __init__(self, rtol=2.0e-6, energy_order=24, action_order=16):
+        self.rtol = rtol
+        self.energy_order = energy_order
+        self.action_order = action_order
+
+    def __repr__(self):
+        return (f"{self.__class__.__name__}(rtol={self.rtol!r}, "
+                f"energy_order={self.energy_order!r}, "
+                f"action_order={self.action_order!r})")
+
+    @classmethod
+    def preset(cls, name):
+        """Return the settings of the preset `name` (see `presets`)."""
+        assert name in cls.presets, f"Unknown preset: {name!r}"
+        return cls(*cls.presets[name])
+
+    def get_kwargs(self, pmass):
+        """Return the keyword arguments of `TransCoeff` and `PFlux`.
+
+        Parameters
+        ----------
+        pmass : float
+            Particle's mass in daltons, which converts the share of the
+            action integrals into a tolerance of A(E).
+        """
+        ln_traco_tol = self.shares['action'] * self.rtol
+        action_tol = float(ln_traco_tol / (2*np.sqrt(2*pmass*dalton2me)))
+        # the fallback must not be looser than the fixed-order rule (its
+        # tolerance is relative to the largest integral, of order 1)
+        fallback = AdaptiveAction(rtol=min(1.0e-10, action_tol))
+        return {'engine': GaussAction(order=self.action_order, tol=action_tol,
+                                      fallback=fallback),
+                'table_tol': self.shares['table'] * self.rtol,
+                'flux_rtol': self.shares['flux'] * self.rtol,
+                'energy_order': self.energy_order}
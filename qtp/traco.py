@@ -2,8 +2,9 @@ import warnings
 
 import numpy as np
 
-from scipy import integrate
-from scipy.interpolate import UnivariateSpline
+from .action import GaussAction
+from .parallel import map_chunks
+from . import profiling
 
 class TransCoeff(object):
     """Transmission coefficient for a particle through a 1D potential barrier.
@@ -16,76 +17,184 @@ class TransCoeff(object):
     pmass : float
         Mass in m_e units of the particle tunneling through the potential barrier.
         1 m_e = 9.10938356e-31 kg.
+
+    executor : concurrent.futures.Executor, optional
+        Pool over which the action integrals of the vectorized methods are
+        distributed, in chunks of `chunk_size` energies.
+        If None, the chunks are evaluated serially.
+
+    engine : action engine, optional
+        Quadrature of the WKB action integrals (see the `action` module); a
+        `GaussAction` by default.
     """
 
-    def __init__(self, peb, pmass, **kwargs):
+    chunk_size = 256
+
+    def __init__(self, peb, pmass, executor=None, engine=None, **kwargs):
         self.peb = peb
         self.pmass = pmass
+        self.executor = executor
+        self.engine = GaussAction() if engine is None else engine
+        self._table = None
+        self._actions = {}
 
-    def _get_traco_type01(self, zval):
-        """Calculate T(E) for a symmetric PEB with single maximum at z=0."""
+    def __getstate__(self):
+        """Drop the executor and the cached results when pickled."""
+        state = self.__dict__.copy()
+        state['executor'] = None
+        state['_table'] = None
+        state['_actions'] = {}
+        return state
 
-        _zero = np.finfo(float).resolution # on a MacBook Pro 2017, this is ca. 1e-15
-        _tiny= 1e-6
+    def with_mass(self, pmass):
+        """Return the transmission coefficient for another particle's mass.
 
-        def fun(x):
-            U = self.peb(x)
-            E = self.peb(zval)
-            if E > U or abs(E-U) < _tiny:
-                ret = 0
+        The WKB action integral, int sqrt(U - E) dz, does not depend on the
+        mass; thus, the new instance shares the action integrals already
+        calculated by this one (and vice versa).
+
+        Parameters
+        ----------
+        pmass : float
+            Mass in m_e units of the tunneling particle.
+        """
+        other = self.__class__(self.peb, pmass, executor=self.executor,
+                               engine=self.engine)
+        other._actions = self._actions
+        return other
+
+    def get_table(self, tol=1.0e-6):
+        """Return an interpolation table of ln(T(E)) on [0, Umax].
+
+        The table is built on first use and refined whenever a tighter
+        tolerance is requested; see `TracoTable`.
+
+        Parameters
+        ----------
+        tol : float, optional
+            Target absolute error of the interpolated ln(T(E)).
+        """
+        with profiling.timer('traco.table'):
+            if self._table is None:
+                self._table = TracoTable(self, tol)
             else:
-                ret = np.sqrt(U - E)
-            return ret
-
-        if abs(zval) < _tiny:
-            ln_traco = 0
-        else:
-            zlims = self.peb.get_zfromUvalue(np.round(self.peb(zval), 8))
-            if len(zlims) != 2 and len(zlims) > 0:
-                z_ = np.max(np.abs(zlims))
-                zlims = [-z_, z_]
-            assert len(zlims) == 2, f"Unexpected number of points with same energy. {zlims, zval}"
-            intgl = integrate.quad(fun, zlims[0], zlims[1], limit=500)
-            ln_traco = -2*np.sqrt(2*self.pmass) * intgl[0]
+                self._table.refine(tol)
+        return self._table
 
-        return ln_traco, np.exp(ln_traco)
+    def get_actions(self):
+        """Return the energies and the action integrals calculated so far."""
+        Evals = np.fromiter(self._actions.keys(), dtype=float)
+        actions = np.fromiter(self._actions.values(), dtype=float)
+        return Evals, actions
 
-    def _get_traco_type02(self, zval):
-        """Calculate T(E) for a symmetric PEB with two maxima when E > U(0).
-        
-        In this case, T(E) is scaled by 1/2 to represent a 50% chance of
-        backscattering after passing throught the first barrier.
+    def add_actions(self, Evals, actions):
+        """Add precalculated action integrals (see `get_actions`)."""
+        self._actions.update(zip(Evals, actions))
+
+    def get_ln_traco_error(self):
+        """Return the error bound of ln(T(E)) due to the action integrals.
+
+        The largest action integral, at E = 0, is calculated if necessary.
+        """
+        factor = 2*np.sqrt(2*self.pmass)
+        action = -self.batch_energy(np.zeros(1))[0][0] / factor
+        return factor * self.engine.get_error(action)
+
+    def get_jumps(self):
+        """Return the energies at which T(E) is discontinuous.
+
+        The turning points jump where E crosses the lowest point of a
+        monotone branch of U(z) (see `PEBBranches`), i.e., a local minimum
+        or an end of the data range, with 0 < E < Umax; e.g., E = U0 for
+        'type02' barriers.
+        Barriers with noisy tails have many of them.
+
+        Return
+        ------
+        Evals, zvals : ndarrays
+            Energies in ascending order, and the points z <= 0 at which
+            U(z) = E is lowest.
         """
+        _tiny = 1.0e-10
+
+        topo = self.peb.topology
+        branches = self.peb.branches
+        zvals = np.array([z[0] for z in branches.zbreaks if z[0] <= 0])
+        Evals = np.array([U[0] for z, U in zip(branches.zbreaks,
+                                               branches.Ubreaks) if z[0] <= 0])
+        if topo.peb_type == 'type02':
+            # U0 is kept exact, as `TransCoeff` splits the energies at it
+            near0 = np.abs(zvals) < 1.0e-6
+            zvals, Evals = np.append(zvals[~near0], 0), \
+                           np.append(Evals[~near0], topo.U0)
+        keep = (Evals > _tiny) & (Evals < topo.Umax - _tiny)
+        zvals, Evals = zvals[keep], Evals[keep]
+        order = np.argsort(Evals, kind='stable')
+        zvals, Evals = zvals[order], Evals[order]
+        # joints of two branches and points at the same energy count once
+        new = np.diff(Evals, prepend=-np.inf) > _tiny
+        return Evals[new], zvals[new]
 
-        _zero = np.finfo(float).resolution # on a MacBook Pro 2017, this is ca. 1e-15
+    def _get_batch_zlims(self, Evals):
+        """Vectorized counterpart of `_get_zlims_type01/02`.
+
+        Return
+        ------
+        zlo, zhi : ndarrays
+            Integration limits for each energy in `Evals`; NaN if the
+            turning points could not be determined.
+        zpts : ndarray with shape (len(Evals), number of branches)
+            All the points for which U(z) = E, sorted along each row and
+            padded with NaN.
+        """
         _tiny= 1e-6
+        _dupl = 1.0e-10  # solutions at the joints of two branches
 
-        def fun(x):
-            U = self.peb(x)
-            E = self.peb(zval)
-            if E > U or abs(E-U) < _tiny:
-                ret = 0
-            else:
-                ret = np.sqrt(U - E)
-            return ret
-
-        z_Umax, Umax = self.peb.get_Umax()
-
-        if abs(self.peb(zval) - Umax) < _tiny:
-            ln_traco = np.log(0.5)
-        else:
-            zlims = [z for z in self.peb.get_zfromUvalue(np.round(self.peb(zval), 8)) if z <= 0]
-            limit_case = len(zlims)==1 \
-                            and abs(self.peb(0) - self.peb(zlims[0])) < _tiny \
-                            and zlims[0] <= z_Umax
-            if limit_case:
-                zlims.append(0)
-            assert len(zlims) == 2,\
-                    f"Unexpected number of points with same energy for z <= 0. (zval: {zval})"
-            intgl = integrate.quad(fun, zlims[0], zlims[1], limit=500)
-            ln_traco = np.log(0.5) - 2*np.sqrt(2*self.pmass) * intgl[0]
+        topo = self.peb.topology
 
-        return ln_traco, np.exp(ln_traco)
+        zpts = np.sort(self.peb.branches.get_zmatrix(Evals), axis=1)
+        with np.errstate(invalid='ignore'):
+            dupl = np.diff(zpts, axis=1) <= _dupl
+        zpts[:, 1:][dupl] = np.nan
+        zpts = np.sort(zpts, axis=1)
+        count = np.sum(~np.isnan(zpts), axis=1)
+
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', RuntimeWarning)
+
+            # outermost turning points (type01 and E < U0)
+            zmax = np.nanmax(np.abs(zpts), axis=1)
+            zlo = np.where(count == 2, zpts[:, 0], -zmax)
+            zhi = np.where(count == 2, zpts[:, 1], zmax)
+            below = (count == 0) & (Evals < topo.Umax)
+            zlo[below] = self.peb.zvals[0]
+            zhi[below] = self.peb.zvals[-1]
+
+            # turning points with z <= 0 (type02 and E >= U0)
+            if topo.peb_type == 'type02':
+                is_type02 = Evals >= topo.U0
+                # roots at the flat bottom of the well are only accurate to
+                # ca. sqrt(machine eps); they all count as z=0
+                near0 = np.abs(zpts) < _tiny
+                left = np.where(near0, 0, np.where(zpts <= 0, zpts, np.nan))
+                count = np.sum(~np.isnan(left) & ~near0, axis=1) \
+                        + near0.any(axis=1)
+                zlo_ = np.nanmin(left, axis=1)
+                zhi_ = np.nanmax(left, axis=1)
+                limit_case = (count == 1) & (np.abs(topo.U0 - Evals) < _tiny) \
+                                & (zlo_ <= topo.z_Umax)
+                zhi_[limit_case] = 0
+                # above the humps of the cubic spline, which may be lower
+                # than the Umax of the quartic one (see `PEBTopology`) where
+                # the data are sparse, the barrier is transparent
+                clear = (count == 0) & (Evals < topo.Umax)
+                zlo_[clear] = zhi_[clear] = topo.z_Umax
+                # noisy tails add turning points beyond the left hump
+                valid = (count >= 2) | limit_case | clear
+                zlo = np.where(is_type02, np.where(valid, zlo_, np.nan), zlo)
+                zhi = np.where(is_type02, np.where(valid, zhi_, np.nan), zhi)
+
+        return zlo, zhi, zpts
 
     def __call__(self, zval):
         """Calculate the transmission coefficient for E = U(zval).
@@ -101,29 +210,342 @@ class TransCoeff(object):
         ------
         ln(T(E)), T(E)
         """
-        _zero = np.finfo(float).resolution # on a MacBook Pro 2017, this is ca. 1e-15
-        _tiny= 1e-6
-
-        U0 = self.peb(0)    # potential energy at z=0
-        E = self.peb(zval)  # particle's energy
-        z_Umax, Umax = self.peb.get_Umax()
-
         # We do bold assumptions here:
         # - it's always assumed that U(z) = U(-z) and U(z) >= 0;
         # - if max. at U(z=0), assume no further maxima;
         # - if max. not at U(z=0), assume a single local minimum at z=0.
-        if abs(z_Umax) < _tiny:
-            peb_type = 'type01'
-        else:
-            if E < U0:
-                peb_type = 'type01'
-            else:
-                peb_type = 'type02'
-        
-        assert peb_type in self.__class__._get_traco, \
-                f"Unrecognized PEB type: '{peb_type}'"
+        # The integrand is the same as that of `batch`, of which this is the
+        # single-point case.
+        ln_traco, traco = self.batch(np.array([zval], dtype=float),
+                                     store=False)
+        return ln_traco[0], traco[0]
+
+    def batch(self, zvals, store=True):
+        """Calculate the transmission coefficients for E = U(z) at once.
+
+        Vectorized counterpart of `__call__`: all the WKB action integrals
+        are evaluated together by `engine`.
+
+        Parameters
+        ----------
+        zvals : array-like
+            Values of z (in bohr) for which E = U(z).
+
+        store : bool, optional
+            Whether the new action integrals are kept for later calls; long
+            streams of energies that are not needed again, such as dense
+            profiles, are evaluated with bounded memory otherwise.
+
+        Return
+        ------
+        ln(T(E)), T(E) : ndarrays with the same shape as `zvals`
+        """
+        zvals = np.asarray(zvals, dtype=float)
+        Evals = self.peb(zvals)
+        ln_traco = self._batch(np.ravel(Evals),
+                               np.ravel(Evals >= self.peb.topology.Umax),
+                               store)
+        ln_traco = ln_traco.reshape(np.shape(zvals))
+        return ln_traco, np.exp(ln_traco)
+
+    def batch_energy(self, Evals):
+        """Calculate the transmission coefficients for the energies `Evals`.
+
+        Parameters
+        ----------
+        Evals : array-like
+            Particle's energies in hartree.
+
+        Return
+        ------
+        ln(T(E)), T(E) : ndarrays with the same shape as `Evals`
+        """
+        Evals = np.asarray(Evals, dtype=float)
+        ln_traco = self._batch(np.ravel(Evals),
+                               np.ravel(Evals >= self.peb.topology.Umax))
+        ln_traco = ln_traco.reshape(np.shape(Evals))
+        return ln_traco, np.exp(ln_traco)
+
+    def _batch(self, Evals, at_top, store=True):
+        """Return ln(T(E)) for the 1D array `Evals`.
+
+        `at_top` flags the energies to be treated as the top of 'type01'
+        barriers, where T(E) = 1; the new action integrals are added to
+        `_actions` if `store` is True.
+        The action integrals of 'type02' barriers vanish linearly towards
+        Umax, and are calculated up to it.
+        """
+        topo = self.peb.topology
+
+        ln_traco = np.zeros_like(Evals)
+        ln_prefac = np.zeros_like(Evals)
+
+        # Action integrals are shared by equal energies
+        uniq_E, inverse = np.unique(Evals, return_inverse=True)
+        inverse = np.ravel(inverse)
+        action = np.zeros(len(uniq_E))
+
+        is_type02 = (topo.peb_type == 'type02') & (uniq_E >= topo.U0)
+        ln_prefac[is_type02[inverse]] = np.log(0.5)
+
+        # energies (and unique energies) that need the action integral
+        needed = np.where(is_type02, uniq_E < topo.Umax, True)[inverse]
+        needed &= is_type02[inverse] | ~at_top
+        todo = np.zeros(len(uniq_E), dtype=bool)
+        todo[inverse[needed]] = True
+
+        # action integrals are computed only once for each energy
+        new_E = [E for E in uniq_E[todo] if E not in self._actions]
+        profiling.count('traco.energies', len(Evals))
+        profiling.count('traco.new_actions', len(new_E))
+        with profiling.timer('traco.actions'):
+            new_actions = dict(zip(new_E, map_chunks(self._get_action, new_E,
+                                                     self.chunk_size,
+                                                     self.executor)))
+        if store:
+            self._actions.update(new_actions)
+            new_actions = self._actions
+        action[todo] = [new_actions[E] if E in new_actions else self._actions[E]
+                        for E in uniq_E[todo]]
+
+        ln_traco[needed] = -2*np.sqrt(2*self.pmass) * action[inverse[needed]]
+
+        return ln_prefac + ln_traco
+
+    def _get_action(self, Evals):
+        """Return the WKB action integrals for the 1D array `Evals`.
+
+        The integrals over all intervals where U(z) > E are evaluated together
+        by `self.engine`.
+        """
+        action = np.zeros(len(Evals))
+        rows, z0, z1 = self.get_intervals(Evals)
+        np.add.at(action, rows, self.engine(self.peb, Evals[rows], z0, z1))
+        return action
+
+    def get_intervals(self, Evals):
+        """Return the intervals of the action integrals for `Evals`.
+
+        Return
+        ------
+        rows : ndarray of int
+            Index in `Evals` of each interval.
+
+        z0, z1 : ndarrays
+            Limits of each interval where U(z) > E.
+        """
+        zlo, zhi, zpts = self._get_batch_zlims(Evals)
+        missing = np.isnan(zlo + zhi)
+        assert not missing.any(), \
+                f"Unexpected number of points with same energy. (E: {Evals[missing]})"
+
+        # Integrate over each interval where U(z) > E separately, which keeps
+        # the square-root behaviour of the WKB integrand at the interval ends
+        zpts = np.where((zpts > zlo[:, None]) & (zpts < zhi[:, None]), zpts, np.nan)
+        zpts = np.sort(np.column_stack([zlo, zpts, zhi]), axis=1)
+        z0, z1 = zpts[:, :-1], zpts[:, 1:]
+        with np.errstate(invalid='ignore'):
+            forbidden = self.peb(np.nan_to_num(0.5*(z0 + z1))) > Evals[:, None]
+        forbidden &= ~np.isnan(z0 + z1)
+        rows = np.nonzero(forbidden)[0]
+        return rows, z0[forbidden], z1[forbidden]
+
+
+class TracoTable(object):
+    """Adaptive interpolation table of ln(T(E)) for E in [0, Umax].
+
+    The energy range [lo, hi] is mapped onto s in [0, 1] by
+    E = lo + (hi - lo) * s**2, which turns the square-root behaviour of
+    ln(T(E)) at the lower end into a linear one.
+    The s range is divided into panels, each holding three nodes (both ends
+    and the midpoint) through which ln(T(E)) is interpolated by a quadratic
+    polynomial in s.
+    A panel is bisected whenever its quadratic misses the values computed
+    at the quarter points by more than the tolerance; the quarter points
+    then become the midpoints of the two new panels.
+    All new nodes of a refinement sweep are computed together with
+    `TransCoeff.batch_energy`.
+    ln(T(E)) is discontinuous at the energies of `TransCoeff.get_jumps`,
+    e.g., at E = U0 for 'type02' barriers; thus, the ranges between them,
+    such as [0, U0) and [U0, Umax], are tabulated separately.
+
+    Parameters
+    ----------
+    traco : TransCoeff instance
+        Calculator for the particle's transmission coefficient T(E).
+
+    tol : float, optional
+        Target absolute error of the interpolated ln(T(E)).
+
+    Attributes
+    ----------
+    tol : float
+        Absolute error of the interpolated ln(T(E)) achieved by the table,
+        which is larger than the target if `max_nodes` was reached.
+
+    max_nodes : int
+        Largest number of nodes of each segment of the table for tol=1e-6;
+        as the error of the quadratic panels scales as their width cubed,
+        it is scaled by (1e-6/tol)**(1/3) for tighter tolerances.
+    """
+
+    max_nodes = 10000
+
+    def __init__(self, traco, tol=1.0e-6):
+
+        _n0 = 17  # initial number of panel limits, evenly spaced in angle
+
+        self._set_bounds(traco)
+
+        # panel limits are clustered around the kinks at both ends
+        s = 0.5 * (1 - np.cos(np.linspace(0, np.pi, _n0)))
+        s = np.insert(s, np.arange(1, len(s)), 0.5*(s[:-1] + s[1:]))
+        self.nodes = [s.copy() for _ in self.bounds]
+        self.vals = [traco.batch_energy(self._get_energy(i, s))[0]
+                     for i in range(len(self.bounds))]
+        self.nevals = sum(len(s) for s in self.nodes)
+
+        self.tol = self._target = np.inf
+        self.refine(tol)
+
+    def _set_bounds(self, traco):
+        """Set the energy range of each segment of the table."""
+        self.traco = traco
+        topo = traco.peb.topology
+
+        self.jumps = traco.get_jumps()[0]
+        lows = np.r_[0, self.jumps]
+        highs = np.r_[np.nextafter(self.jumps, -np.inf), topo.Umax]
+        self.bounds = list(zip(lows, highs))
+        self.Umax = topo.Umax
+
+    def to_arrays(self):
+        """Return the nodes of the table as a dict of arrays."""
+        arrays = {'tol': np.array(self.tol)}
+        for i, (s, y) in enumerate(zip(self.nodes, self.vals)):
+            arrays[f'nodes{i}'] = s
+            arrays[f'vals{i}'] = y
+        return arrays
+
+    @classmethod
+    def from_arrays(cls, traco, arrays):
+        """Rebuild a table for `traco` from the output of `to_arrays`.
+
+        Return None if the table was saved with other segments.
+        """
+        table = cls.__new__(cls)
+        table._set_bounds(traco)
+        if f'nodes{len(table.bounds) - 1}' not in arrays:
+            return None
+        table.nodes = [np.asarray(arrays[f'nodes{i}'])
+                       for i in range(len(table.bounds))]
+        table.vals = [np.asarray(arrays[f'vals{i}'])
+                      for i in range(len(table.bounds))]
+        table.nevals = 0
+        table.tol = table._target = float(arrays['tol'])
+        return table
+
+    def _get_energy(self, i, s):
+        """Return the energies for the coordinates `s` of segment `i`."""
+        lo, hi = self.bounds[i]
+        return lo + (hi - lo) * s**2
+
+    def refine(self, tol):
+        """Bisect panels until the interpolation error is below `tol`.
+
+        If the panels become too narrow, or the table would exceed
+        `max_nodes`, the refinement stops short of `tol`; near `max_nodes`,
+        the panels with the largest errors are bisected first, and `tol` is
+        then the largest error estimate of the panels left unconverged.
+        """
+
+        # narrowest panel in s; next to a local top of the barrier, ln T has
+        # a logarithmic kink, where the error scales with the panel width
+        _small = 1.0e-2 * tol
+
+        if tol >= self._target:
+            return
+        self._target = tol
+        max_nodes = int(self.max_nodes * max(1.0e-6/tol, 1)**(1/3))
+
+        active = [np.ones(len(s)//2, dtype=bool) for s in self.nodes]
+        # error estimates of the panels, bounded by the previous tolerance
+        errors = [np.full(len(s)//2, self.tol) for s in self.nodes]
+        achieved = tol
+        full = False
+
+        while any(a.any() for a in active):
+            quarters = []
+            for i, (s, a) in enumerate(zip(self.nodes, active)):
+                stop = a & (s[2::2] - s[:-2:2] <= _small)
+                # each bisection adds two nodes
+                room = max((max_nodes - len(s)) // 2, 0)
+                if (a & ~stop).sum() > room:
+                    full = True
+                    worst = np.flatnonzero(a & ~stop)
+                    worst = worst[np.argsort(errors[i][worst])[::-1][:room]]
+                    stop = a.copy()
+                    stop[worst] = False
+                achieved = max(achieved, errors[i][stop].max(initial=0))
+                a &= ~stop
+                q = 0.5*(s[:-1] + s[1:]).reshape(-1, 2)
+                quarters.append(q[a].ravel())
+            if sum(len(q) for q in quarters) == 0:
+                break
+            new_vals = self.traco.batch_energy(np.concatenate(
+                [self._get_energy(i, q) for i, q in enumerate(quarters)]))[0]
+            self.nevals += len(new_vals)
+            profiling.count('table.sweeps')
+            profiling.count('table.new_nodes', len(new_vals))
+
+            start = 0
+            for i, a in enumerate(active):
+                q = quarters[i]
+                y = new_vals[start:start + len(q)]
+                start += len(q)
+                err = np.abs(self._interpolate(i, q) - y).reshape(-1, 2)
+                err = err.max(axis=1)
+                bad = err > tol
+
+                # each refined panel becomes two panels, whose errors are
+                # bounded by that of their parent
+                idx = np.searchsorted(self.nodes[i], q)
+                self.nodes[i] = np.insert(self.nodes[i], idx, q)
+                self.vals[i] = np.insert(self.vals[i], idx, y)
+                panel_idx = np.flatnonzero(a)
+                active[i] = np.insert(a, panel_idx + 1, bad)
+                active[i][panel_idx + np.arange(len(panel_idx))] = bad
+                errors[i] = np.insert(errors[i], panel_idx + 1, err)
+                errors[i][panel_idx + np.arange(len(panel_idx))] = err
+
+        if full:
+            warnings.warn(f"TracoTable: maximum number of nodes reached"
+                          f" before achieving tol={tol}.")
+        self.tol = achieved
+
+    def _interpolate(self, i, s):
+        """Evaluate the piecewise quadratic interpolant of segment `i`."""
+        x, y = self.nodes[i], self.vals[i]
+        k = 2*np.clip(np.searchsorted(x[::2], s) - 1, 0, len(x)//2 - 1)
+        x0, x1, x2 = x[k], x[k+1], x[k+2]
+        y0, y1, y2 = y[k], y[k+1], y[k+2]
+        return y0 * (s - x1)*(s - x2) / ((x0 - x1)*(x0 - x2)) \
+             + y1 * (s - x0)*(s - x2) / ((x1 - x0)*(x1 - x2)) \
+             + y2 * (s - x0)*(s - x1) / ((x2 - x0)*(x2 - x1))
 
-        return self._get_traco[peb_type](self, zval)
+    def _get_s(self, i, Evals):
+        """Return the coordinates s of segment `i` for the energies `Evals`."""
+        lo, hi = self.bounds[i]
+        return np.sqrt(np.clip((Evals - lo) / (hi - lo), 0, 1))
 
-    _get_traco = {'type01': _get_traco_type01,
-                  'type02': _get_traco_type02}
\ No newline at end of file
+    def __call__(self, Evals):
+        """Return the interpolated ln(T(E)) for the energies `Evals`."""
+        Evals = np.asarray(Evals, dtype=float)
+        if len(self.nodes) == 1:
+            return self._interpolate(0, self._get_s(0, Evals))
+        segment = np.searchsorted(self.jumps, Evals, side='right')
+        ln_traco = np.zeros(Evals.shape)
+        for i in range(len(self.nodes)):
+            inside = segment == i
+            ln_traco[inside] = self._interpolate(i, self._get_s(i, Evals[inside]))
+        return ln_traco
@@ -0,0 +1,6 @@
+"""Conversion factors into atomic units."""
+from scipy import constants
+
+dalton2me = constants.atomic_mass/constants.m_e
+kelvin2au = 1 / (constants.value('Hartree energy')/constants.k)
+angst2bohr = constants.angstrom/constants.value('Bohr radius')
@@ -0,0 +1,31 @@
+"""Evaluation of the barrier's spline against FITPACK."""
+import numpy as np
+import pytest
+from scipy.interpolate import UnivariateSpline
+
+from qtp.peb import PEBPoly
+
+
+@pytest.fixture(scope='module')
+def splines():
+    z = np.linspace(0, 3, 20)
+    spl = UnivariateSpline(z, np.cos(z), s=0)
+    return spl, PEBPoly(spl._eval_args)
+
+
+# inside and outside of the data range [0, 3]
+@pytest.mark.parametrize('z', [1, 100, -1, np.array(1.0), np.array(100.0),
+                               1.5, 100.0, np.array([-1.0, 1.0, 100.0])])
+@pytest.mark.parametrize('ext', [0, 1, 3])
+@pytest.mark.parametrize('der', [0, 1])
+def test_scalar_and_array_inputs(splines, z, ext, der):
+    spl, poly = splines
+    U = poly(z, der=der, ext=ext)
+    assert np.shape(U) == np.shape(z)
+    assert np.allclose(U, spl(z, nu=der, ext=ext), rtol=1.0e-12, atol=1.0e-12)
+
+
+@pytest.mark.parametrize('z', [100, np.array(100.0), 100.0])
+def test_out_of_range_raises(splines, z):
+    with pytest.raises(ValueError):
+        splines[1](z, ext=2)
@@ -0,0 +1,44 @@
+"""Sensitivities of ln k to the data points against central differences."""
+import numpy as np
+import pytest
+
+from qtp.benchmark import Gaussian
+from qtp.calculator import Calculator
+from qtp.units import angst2bohr
+
+temps_K = [150.0, 300.0, 600.0]
+npts = 41
+h = 1.0e-7  # step in hartree
+
+
+def get_calculator(zvals, Uvals):
+    # the table noise is kept well below the step
+    return Calculator(zvals, Uvals, pmass=1.0, table_tol=1.0e-9)
+
+
+@pytest.fixture(scope='module')
+def barrier():
+    zvals, Uvals = Gaussian().get_data(npts)
+    return zvals/angst2bohr, Uvals
+
+
+@pytest.fixture(scope='module')
+def sensitivities(barrier):
+    return get_calculator(*barrier).sensitivities(temps_K)
+
+
+# away from the lowest point, at z = L, which shifts the whole barrier
+@pytest.mark.parametrize('i', [0, npts//8, npts//4, npts//2])
+def test_central_differences(barrier, sensitivities, i):
+    zvals, Uvals = barrier
+    dU = np.zeros(npts)
+    dU[i] = h
+    ln_k = [get_calculator(zvals, Uvals + sign*dU).rates(temps_K)
+            for sign in (1, -1)]
+    comps = ('classic', 'tunnel', 'total')
+    fd = np.array([ln_k[0][f'ln_k_{c}'] - ln_k[1][f'ln_k_{c}']
+                   for c in comps]) / (2*h)
+    sens = np.array([sensitivities[f'dlnk_dU_{c}'][:, i] for c in comps])
+    # the errors are relative to the largest derivative, as the classical
+    # rate depends on the top only
+    assert np.abs(sens - fd).max() < 1.0e-4 * np.abs(fd).max()